@@ -0,0 +1,233 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: arbitrage_reporter.py
+
+An event sink that takes reporting off the hot path of the subscriber. The
+compute stage hands small event dictionaries to the reporter through a
+bounded queue, and a background writer thread formats and writes them, either
+as the familiar text lines or as one JSON object per line.
+
+Events are dictionaries with a 'type' key:
+
+    quote       cross, price, venue, timestamp
+    ignored     cross, timestamp of an out-of-sequence quote
+    stale       count of quotes removed
+    arbitrage   cycle, rates, values, venues, start, profit, profit_bps,
+                latency
+    metrics     stages, the latency summary of each pipeline stage
+
+Timestamps are handed over as seconds since the UNIX epoch and formatted as
+ISO 8601 by the writer thread.
+
+Repeats of an identical arbitrage cycle within the dedup interval are
+suppressed, and the number of arbitrage reports per second can be capped.
+If the writer falls behind, events that do not fit in the queue are dropped
+and counted rather than blocking the compute stage.
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import timedelta
+from pipeline_metrics import format_summary
+from quote_graph import EPOCH
+
+QUEUE_SIZE = 4096       # Number of events waiting to be written
+DEDUP_INTERVAL = 1.0    # Seconds to suppress repeats of the same cycle
+TEXT = 'text'           # Output format of the text lines
+JSON = 'json'           # Output format of one JSON object per line
+
+class ArbitrageReporter(object):
+    """
+    ArbitrageReporter writes events from the compute stage on a background
+    thread.
+    """
+
+    def __init__(self, output=None, format=TEXT, dedup_interval=DEDUP_INTERVAL,
+                 max_per_second=None, queue_size=QUEUE_SIZE) -> None:
+        """
+        The ArbitrageReporter constructor creates the event queue and the
+        writer thread.
+
+        Args:
+            output:
+                The file object to write to, defaults to sys.stdout
+            format:
+                TEXT or JSON
+            dedup_interval:
+                Seconds during which a repeat of the same arbitrage cycle is
+                suppressed, or 0 to report every repeat
+            max_per_second:
+                The most arbitrage reports to write per second, or None for
+                no limit
+            queue_size:
+                The number of events that can wait to be written
+        """
+
+        if format not in (TEXT, JSON):
+            raise ValueError('Unknown report format {}'.format(format))
+
+        self.output = output if output is not None else sys.stdout
+        self.format = format
+        self.dedup_interval = dedup_interval
+        self.max_per_second = max_per_second
+
+        self.events = queue.Queue(queue_size)
+        self.writer = threading.Thread(target=self.write_events, daemon=True)
+
+        self.last_cycle = {}    # Time each cycle was last written
+        self.window = 0         # Start of the current rate limit second
+        self.written = 0        # Arbitrage reports written this second
+
+        # Counters
+        self.dropped = 0        # Events lost because the queue was full
+        self.suppressed = 0     # Arbitrage reports deduplicated or limited
+
+    def start(self):
+        """
+        Starts the writer thread.
+        """
+
+        self.writer.start()
+
+    def stop(self):
+        """
+        Writes the remaining events and stops the writer thread.
+        """
+
+        self.events.put(None)
+        self.writer.join()
+
+    def report(self, event):
+        """
+        Hands an event to the writer without blocking.
+
+        Args:
+            event:
+                The event dictionary, with a 'type' key
+        """
+
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_events(self):
+        """
+        Writes events from the queue until stop is called.
+        """
+
+        while True:
+            event = self.events.get()
+
+            if event is None:
+                break   # Stop requested
+
+            if event['type'] == 'arbitrage' and not self.allow(event):
+                self.suppressed += 1
+                continue
+
+            # Format the timestamp off the compute stage
+            if 'timestamp' in event:
+                event['timestamp'] = (EPOCH + timedelta(seconds=event['timestamp'])).isoformat()
+
+            if self.format == JSON:
+                self.output.write(json.dumps(event) + '\n')
+            else:
+                self.output.write(self.format_text(event))
+
+            # Flush once the writer has caught up with the queue
+            if self.events.empty():
+                self.output.flush()
+
+        self.output.flush()
+
+    def allow(self, event) -> bool:
+        """
+        Decides whether an arbitrage event should be written, applying the
+        dedup interval and the rate limit.
+
+        Args:
+            event:
+                The arbitrage event
+
+        Returns:
+            True if the event should be written
+        """
+
+        now = time.monotonic()
+        cycle = tuple(event['cycle'])
+
+        # Suppress a cycle seen within the dedup interval
+        if now - self.last_cycle.get(cycle, -self.dedup_interval) < self.dedup_interval:
+            return False
+
+        # Suppress reports over the limit for the current second
+        if self.max_per_second is not None:
+            if now - self.window >= 1.0:
+                self.window = now
+                self.written = 0
+            if self.written >= self.max_per_second:
+                return False
+            self.written += 1
+
+        self.last_cycle[cycle] = now
+
+        # Forget cycles that are past the dedup interval
+        if len(self.last_cycle) > QUEUE_SIZE:
+            self.last_cycle = {seen: at for seen, at in self.last_cycle.items()
+                               if now - at < self.dedup_interval}
+
+        return True
+
+    @staticmethod
+    def format_text(event) -> str:
+        """
+        Formats an event as the text lines printed by Lab3.
+
+        Args:
+            event:
+                The event dictionary
+
+        Returns:
+            The formatted lines, ending with a newline
+        """
+
+        kind = event['type']
+
+        if kind == 'quote':
+            return '[{}] {} {} @ {}\n'.format(event['timestamp'], event['cross'],
+                                              event['price'], event['venue'])
+
+        if kind == 'ignored':
+            return 'Ignoring out-of-sequence message\n'
+
+        if kind == 'stale':
+            return 'Removed {} stale quotes\n'.format(event['count'])
+
+        if kind == 'arbitrage':
+            cycle = event['cycle']
+            lines = ['ARBITRAGE', '\tstart with {} {}'.format(event['start'], cycle[0])]
+
+            # One line per exchange along the cycle
+            for i, rate in enumerate(event['rates']):
+                lines.append('\texchange {} for {} at {} on {} --> {} {}'.format(
+                    cycle[i], cycle[i + 1], rate, event['venues'][i],
+                    event['values'][i], cycle[i + 1]))
+
+            lines.append('\t-> profit of {} {} ({:.2f} bps)'.format(
+                event['profit'], cycle[0], event['profit_bps']))
+            lines.append('\t   detected in {:.6f} s'.format(event['latency']))
+            return '\n'.join(lines) + '\n'
+
+        if kind == 'metrics':
+            return format_summary(event['stages']) + '\n'
+
+        return '{}\n'.format(event)
@@ -35,11 +35,12 @@ class Bellman_Ford(object):
         Bellman_Ford object constructor
 
         Args:
-            graph: The passed in graph used for the Bellman-Ford analysis
+            graph: The QuoteGraph used for the Bellman-Ford analysis. Its
+                src, dst and weight arrays are read directly as the edge list.
         """
 
         self.graph = graph
-        self.vertices = len(graph)
+        self.vertices = graph.vertex_count
 
     def shortest_paths(self, start_vertex, tolerance=0):
         """
@@ -55,54 +56,75 @@ class Bellman_Ford(object):
 
         Args:
             start_vertex: 
-                The start of all the paths
+                The currency name at the start of all the paths
             tolerance:
                 Value to determine if a path needs to be relaxed
         
         Returns:
             distance:
-                A dictionary keyed by vertex of shortest distance from 
+                A list indexed by vertex id of shortest distance from 
                 start_vertex to that vertex
             predecessor:
-                A dictionary keyed by vertex of previous vertex in shortest path
-                from start_vertex
+                A list indexed by vertex id of previous vertex id in shortest
+                path from start_vertex
             negative_cyle:
-                None if no negative cycle found, otherwise an edge (u,v) in
-                such a negative cycle
+                None if no negative cycle found, otherwise an edge (u,v) of
+                vertex ids in such a negative cycle
         """
 
-        # Construct dictionaries from the graph by initializing the shortest
-        # distance to infinity and predecessor vertex to None
-        distance = {vertex: FLOAT_REF for vertex in self.graph}
-        predecessor = {vertex: None for vertex in self.graph}
-        
+        # Local references to the edge list of the graph
+        graph = self.graph
+        src, dst, weight = graph.src, graph.dst, graph.weight
+        edges = range(graph.edge_count)
+
+        # Initialize the shortest distance to infinity and predecessor vertex
+        # to None for every vertex id
+        distance = [FLOAT_REF] * self.vertices
+        predecessor = [None] * self.vertices
+
+        # Nothing can be reached from a currency that has not been quoted
+        start = graph.id_of(start_vertex)
+        if start is None:
+            return distance, predecessor, None
+
         # Set the shortest distance of the start_vertex to 0
-        distance[start_vertex] = 0
+        distance[start] = 0
 
         # Determine shortest path
-        # Loop through the graph and relax all edges to find the shortest path
+        # Loop through the edges and relax them to find the shortest path
         # with at most vertices - 1 edges
         for _ in range(self.vertices - 1):
-            # Update distance and precessor based on the adjacent vertices that
-            # are next within the graph
-            for current in self.graph:
-                for next in self.graph[current]:
-                    weight = self.graph[current][next]['price']
-                    
-                    if distance[current] is not FLOAT_REF and distance[current] + weight + tolerance < distance[next]:
-                        distance[next] = distance[current] + weight
-                        predecessor[next] = current
+            relaxed = False
+
+            # Update distance and precessor based on each edge in the graph
+            for e in edges:
+                current = src[e]
+                if distance[current] is FLOAT_REF:
+                    continue
+
+                next = dst[e]
+                candidate = distance[current] + weight[e]
+                if candidate + tolerance < distance[next]:
+                    distance[next] = candidate
+                    predecessor[next] = current
+                    relaxed = True
+
+            # Stop early once a full pass changes nothing
+            if not relaxed:
+                return distance, predecessor, None
         
         # Negative cycle detection
-        # Loop through the entire graph to look for negative distance values
-        for current in self.graph:
-            for next in self.graph[current]:
-                weight = self.graph[current][next]['price']
-            
-                if distance[current] is not FLOAT_REF and distance[current] + weight + tolerance < distance[next]:
-                    # Return the distance, predecessor dictionaires and the edge
-                    # for the negative cycle
-                    return distance, predecessor, (current, next)
+        # Loop through the edges to look for negative distance values
+        for e in edges:
+            current = src[e]
+            if distance[current] is FLOAT_REF:
+                continue
+
+            next = dst[e]
+            if distance[current] + weight[e] + tolerance < distance[next]:
+                # Return the distance, predecessor lists and the edge for the
+                # negative cycle
+                return distance, predecessor, (current, next)
         
-        # Return distance and predecessor dictionaries, with None for edge
-        return distance, predecessor, None
\ No newline at end of file
+        # Return distance and predecessor lists, with None for edge
+        return distance, predecessor, None
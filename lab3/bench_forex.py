@@ -0,0 +1,294 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: bench_forex.py
+
+Benchmark suite for the Forex path. A seeded synthetic quote generator feeds
+each stage of the pipeline on its own, and then the full loop, and the
+throughput and latency percentiles of each are reported:
+
+    marshal     fxp_bytes.marshal_message
+    unmarshal   fxp_bytes_subscriber.unmarshal_message
+    add_node    Lab3.add_node for every quote of a message
+    manage      Lab3.manage_nodes, with the clock advanced a message at a time
+    detect      Bellman_Ford.shortest_paths
+    loop        unmarshal, sequencing, add_node, manage_nodes and detect
+
+Results can be saved as a baseline file, and later runs compared against it
+so that a stage whose throughput drops by more than the tolerance fails the
+run.
+
+Usage:
+    python3 bench_forex.py [--currencies N] [--quotes N] [--messages N]
+                           [--cycle-rate P] [--seed S]
+                           [--save-baseline | --compare] [--baseline FILE]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import fxp_bytes
+import fxp_bytes_subscriber as subscriber
+from bellman_ford import Bellman_Ford
+from lab3 import DEFAULT_CURRENCY, QUOTE_EXPIRY, TOLERANCE, Lab3
+from pipeline_metrics import LatencyHistogram
+from quote_graph import to_seconds
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_CURRENCIES = 8      # Currencies quoted against USD
+DEFAULT_QUOTES = 10         # Quotes in each message
+DEFAULT_MESSAGES = 2000     # Messages run through each stage
+DEFAULT_CYCLE_RATE = 0.05   # Chance of injecting a mispriced cross
+DEFAULT_SEED = 5520         # Seed of the quote generator
+TOLERANCE_PERCENT = 25      # Allowed throughput drop against the baseline
+
+class QuoteGenerator(object):
+    """
+    QuoteGenerator produces reproducible messages of quotes for a configurable
+    number of currencies, occasionally with a mispriced cross that creates an
+    arbitrage cycle.
+    """
+
+    def __init__(self, currencies=DEFAULT_CURRENCIES, quotes=DEFAULT_QUOTES,
+                 cycle_rate=DEFAULT_CYCLE_RATE, seed=DEFAULT_SEED) -> None:
+        """
+        The QuoteGenerator constructor creates the currency codes and their
+        reference prices in USD.
+
+        Args:
+            currencies:
+                The number of currencies quoted against USD
+            quotes:
+                The number of quotes in each message, at most
+                MAX_QUOTES_PER_MESSAGE
+            cycle_rate:
+                The chance of each message carrying a mispriced cross
+            seed:
+                The seed of the random generator
+        """
+
+        if not 0 < quotes <= fxp_bytes.MAX_QUOTES_PER_MESSAGE:
+            raise ValueError('quotes per message must be 1 to {}'.format(
+                fxp_bytes.MAX_QUOTES_PER_MESSAGE))
+
+        self.random = random.Random(seed)
+        self.quotes = quotes
+        self.cycle_rate = cycle_rate
+
+        # Three letter codes AAA, AAB, ... that never clash with USD
+        self.currencies = [chr(65 + i // 676) + chr(65 + i // 26 % 26) + chr(65 + i % 26)
+                           for i in range(currencies)]
+        self.reference = {ccy: self.random.uniform(0.5, 150.0) for ccy in self.currencies}
+        self.timestamp = datetime.utcnow()
+
+    def message(self) -> list:
+        """
+        Returns the quotes of the next message. Each message is timestamped
+        at least a microsecond after the one before, so none is taken for an
+        out of sequence duplicate.
+        """
+
+        quotes = []
+        timestamp = max(datetime.utcnow(), self.timestamp + timedelta(microseconds=1))
+        self.timestamp = timestamp
+
+        for _ in range(self.quotes):
+            # Random walk the price of a currency against USD
+            ccy = self.random.choice(self.currencies)
+            self.reference[ccy] *= self.random.gauss(1.0, 0.0001)
+            quotes.append({'timestamp': timestamp, 'cross': 'USD/' + ccy,
+                           'price': self.reference[ccy]})
+
+        # Occasionally misprice a cross between two currencies
+        if len(self.currencies) > 1 and self.random.random() < self.cycle_rate:
+            xxx, yyy = self.random.sample(self.currencies, 2)
+            rate = self.reference[yyy] / self.reference[xxx] * self.random.gauss(1.0, 0.01)
+            quotes[-1] = {'timestamp': timestamp, 'cross': '{}/{}'.format(xxx, yyy), 'price': rate}
+
+        return quotes
+
+def new_subscriber() -> Lab3:
+    """
+    Returns a Lab3 to drive directly, without sockets or threads.
+    """
+
+    return Lab3([('localhost', 0)], port=0)
+
+def measure(name, iterations, step) -> dict:
+    """
+    Times each call of a step and summarizes the results.
+
+    Args:
+        name:
+            The name of the stage
+        iterations:
+            The number of calls to time
+        step:
+            A function taking the iteration number
+
+    Returns:
+        The stage results with throughput in operations per second and
+        latency percentiles in microseconds
+    """
+
+    histogram = LatencyHistogram()
+    clock = time.perf_counter
+    started = clock()
+
+    for i in range(iterations):
+        start = clock()
+        step(i)
+        histogram.record(clock() - start)
+
+    elapsed = clock() - started
+    summary = histogram.summary()
+
+    return {'stage': name, 'ops': iterations, 'ops_per_sec': iterations / elapsed,
+            'p50': summary['p50'], 'p99': summary['p99'], 'max': summary['max']}
+
+def run_suite(currencies=DEFAULT_CURRENCIES, quotes=DEFAULT_QUOTES, messages=DEFAULT_MESSAGES,
+              cycle_rate=DEFAULT_CYCLE_RATE, seed=DEFAULT_SEED) -> list:
+    """
+    Runs every stage of the benchmark against the same generated messages.
+
+    Returns:
+        The list of stage results
+    """
+
+    generator = QuoteGenerator(currencies, quotes, cycle_rate, seed)
+    sequence = [generator.message() for _ in range(messages)]
+    datagrams = [fxp_bytes.marshal_message(quotes) for quotes in sequence]
+    decoded = [subscriber.unmarshal_message(datagram) for datagram in datagrams]
+    results = []
+
+    results.append(measure('marshal', messages,
+                           lambda i: fxp_bytes.marshal_message(sequence[i])))
+    results.append(measure('unmarshal', messages,
+                           lambda i: subscriber.unmarshal_message(datagrams[i])))
+
+    # Graph updates against a fresh subscriber
+    lab3 = new_subscriber()
+
+    def add_nodes(i):
+        for quote in decoded[i]:
+            lab3.add_node(quote['cross'].split('/'), quote)
+
+    results.append(measure('add_node', messages, add_nodes))
+
+    analysis = Bellman_Ford(lab3.graph)
+    results.append(measure('detect', messages,
+                           lambda i: analysis.shortest_paths(DEFAULT_CURRENCY, TOLERANCE)))
+
+    # Expire the quotes in the order they were added, as if the clock had
+    # moved past each message's expiry in turn, until the graph is empty
+    deadlines = [to_seconds(quotes[0]['timestamp']) + QUOTE_EXPIRY for quotes in sequence]
+    results.append(measure('manage', messages, lambda i: lab3.manage_nodes(deadlines[i])))
+
+    # Full loop of the compute stage against another fresh subscriber
+    loop = new_subscriber()
+
+    def full_loop(i):
+        latest = {}
+        for quote in subscriber.unmarshal_message(datagrams[i]):
+            if loop.sequencer.accept((0, quote['cross']), to_seconds(quote['timestamp'])):
+                latest[quote['cross']] = quote
+        for cross, quote in latest.items():
+            loop.add_node(cross.split('/'), quote)
+        loop.manage_nodes()
+        loop.detect(time.monotonic())
+
+    results.append(measure('loop', messages, full_loop))
+
+    return results
+
+def compare(results, baseline, tolerance=TOLERANCE_PERCENT) -> list:
+    """
+    Compares stage throughput with a baseline.
+
+    Args:
+        results:
+            The list of stage results of this run
+        baseline:
+            The list of stage results from the baseline file
+        tolerance:
+            The percent drop in throughput that counts as a regression
+
+    Returns:
+        The list of (stage, baseline ops/s, current ops/s) regressions
+    """
+
+    expected = {result['stage']: result['ops_per_sec'] for result in baseline}
+    regressions = []
+
+    for result in results:
+        before = expected.get(result['stage'])
+        if before and result['ops_per_sec'] < before * (1 - tolerance / 100):
+            regressions.append((result['stage'], before, result['ops_per_sec']))
+
+    return regressions
+
+def format_results(results) -> str:
+    """
+    Formats the stage results as a table.
+    """
+
+    lines = ['{:<10}{:>12}{:>10}{:>10}{:>10}'.format('stage', 'ops/s', 'p50 us', 'p99 us', 'max us')]
+
+    for result in results:
+        lines.append('{:<10}{:>12.0f}{:>10}{:>10}{:>10}'.format(
+            result['stage'], result['ops_per_sec'], result['p50'], result['p99'], result['max']))
+
+    return '\n'.join(lines)
+
+
+# Main Function
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark the Forex pipeline stages')
+    parser.add_argument('--currencies', type=int, default=DEFAULT_CURRENCIES)
+    parser.add_argument('--quotes', type=int, default=DEFAULT_QUOTES,
+                        help='price updates in each message')
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES)
+    parser.add_argument('--cycle-rate', type=float, default=DEFAULT_CYCLE_RATE)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE_PERCENT,
+                        help='percent throughput drop allowed against the baseline')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save-baseline', action='store_true')
+    mode.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    config = {'currencies': args.currencies, 'quotes': args.quotes, 'messages': args.messages,
+              'cycle_rate': args.cycle_rate, 'seed': args.seed}
+    results = run_suite(**config)
+    print(format_results(results))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'config': config, 'results': results}, file, indent=2)
+        print('Saved baseline to {}'.format(args.baseline))
+
+    elif args.compare:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if baseline['config'] != config:
+            print('Warning: baseline was run with {}'.format(baseline['config']))
+
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for stage, before, after in regressions:
+            print('REGRESSION {}: {:.0f} -> {:.0f} ops/s'.format(stage, before, after))
+
+        if regressions:
+            sys.exit(1)
+        print('No regressions beyond {}%'.format(args.tolerance))
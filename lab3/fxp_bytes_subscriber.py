@@ -114,7 +114,8 @@ def unmarshal_message(msg: bytes) -> list:
 
     Args:
         msg:
-            The byte stream representation of the message
+            The byte stream representation of the message, as bytes or a
+            memoryview of a receive buffer
     Returns:
         quotes:
             The list of quotes in a dictionary string format
@@ -133,7 +134,7 @@ def unmarshal_message(msg: bytes) -> list:
         
         # Assign parts of the byte stream to entries in the dictionary
         info['timestamp'] = deserialize_utcdatetime(msg_bytes[0:8])
-        info['cross'] = msg_bytes[8:11].decode(ENCODING) + '/' + msg_bytes[11:14].decode(ENCODING)
+        info['cross'] = str(msg_bytes[8:11], ENCODING) + '/' + str(msg_bytes[11:14], ENCODING)
         info['price'] = deserialize_price(msg_bytes[14:22])
 
         quotes.append(info)     # Add info dictionary to quotes list
@@ -14,43 +14,119 @@ opportunity available.
 
 """
 
+import argparse
 import fxp_bytes_subscriber as subscriber
 import math
 import socket
-import sys
 import threading
+import time
+from arbitrage_reporter import ArbitrageReporter, TEXT
 from bellman_ford import Bellman_Ford
-from datetime import datetime, timedelta
-
-BUFFER_SIZE = 1024          # Constant for receiving buffer size
+from datetime import datetime
+from pipeline_metrics import MetricsServer, PipelineMetrics
+from quote_expiry import ExpiryHeap
+from quote_graph import CrossSequencer, QuoteGraph, to_seconds
+from quote_pipeline import RingBuffer
+from quote_bus import BusReceiver, QuoteBusReader, unpack_quotes
+from quote_receiver import BatchReceiver
+from subscription_renewal import LEASE, RenewalScheduler
+
+RCVBUF_SIZE = 1 << 20       # Constant for kernel receive buffer size
 DEFAULT_CURRENCY = 'USD'    # Constant for base currency
-MSG_BUFFER = 0.1            # Constant for time between messages
+BASIS_POINTS = 10000        # Constant for basis points in a whole
+LISTENER_PORT = 50000       # First port to receive quotes on
+METRICS_INTERVAL = 10       # Seconds between latency summaries
+MIN_PROFIT_BPS = 1.0        # Smallest profit in basis points worth reporting
 QUOTE_EXPIRY = 1.5          # Constant for duration of quotes
+RECV_TIMEOUT = 0.5          # Time in seconds between checks of the expiry
 STARTING_AMOUNT = 100       # Starting dollar amount
-SUBSCRIPTION_EXPIRY = 600   # Time in seconds for subsription to be valid
+SUBSCRIPTION_EXPIRY = LEASE # Time in seconds for subsription to be valid
 TOLERANCE = 1e-12           # Constant for tolerance
 
 class Lab3(object):
     """
     Lab3 creates a subsrciption client that runs the Bellman-Ford algorithm on
-    incoming data from a exchange data publisher.
+    incoming data from one or more exchange data publishers.
+
+    Each publisher is a venue with its own listening socket, and the quotes of
+    every venue go into one graph that keeps the best rate for each pair in
+    each direction, so arbitrage across venues is detected in a single pass.
     """
 
-    def __init__(self, address) -> None:
+    def __init__(self, addresses, report_format=TEXT, port=LISTENER_PORT,
+                 duration=None, lease=SUBSCRIPTION_EXPIRY, metrics_file=None,
+                 metrics_port=None, min_profit_bps=MIN_PROFIT_BPS, bus=None) -> None:
         """
-        The Lab3 Constructor initializes the publisher address, creates a graph
-        structure, defines the listener address, and sets a starting time.
+        The Lab3 Constructor initializes the publisher addresses, creates a
+        graph structure, defines the listener addresses, and sets a starting
+        time.
 
         Args:
-            address:
-                The passed in address for the publisher server
+            addresses:
+                The list of addresses of the publisher servers, one for each
+                venue in venue id order, or an empty list when reading a bus
+            report_format:
+                The output format of the reporter, 'text' or 'json'
+            port:
+                The port to receive quotes from the first venue on, with one
+                port more for each venue after it, or 0 to pick free ports
+            duration:
+                The number of seconds to run for, or None to run until stopped
+            lease:
+                The number of seconds the publishers keep a subscription
+            metrics_file:
+                The JSON file to write the stage latencies to on every
+                summary, or None
+            metrics_port:
+                The local port to serve the stage latencies on, or None
+            min_profit_bps:
+                The smallest profit of a cycle, in basis points, that is
+                reported as an arbitrage
+            bus:
+                The name of a quote bus to read the feeds from instead of
+                subscribing to publishers, or None
         """
 
-        self.publisher = address
-        self.graph = {}
+        self.publishers = list(addresses)
+        self.venues = ['{}:{}'.format(*address) for address in self.publishers]
+        self.duration = duration
+        self.stopped = threading.Event()
+
+        # The bus daemon subscribes for every venue on the bus
+        self.bus_reader = QuoteBusReader(bus) if bus is not None else None
+        self.unmarshal = unmarshal_quotes   # Decodes a datagram into quotes
+        if self.bus_reader is not None:
+            # Bus records were converted once by the daemon
+            self.unmarshal = unpack_quotes
+            self.venues = ['{}/{}'.format(bus, venue) for venue in range(self.bus_reader.venues)]
+
+        self.graph = QuoteGraph(venues=len(self.venues))
+        self.expiry = ExpiryHeap(self.graph, QUOTE_EXPIRY)
+        self.sequencer = CrossSequencer()
+
+        # Cycles scoring below the minimum profit are counted, not reported
+        self.min_profit_bps = min_profit_bps
+        self.rejected = 0
+
+        # Bounded buffer between the receiver and compute stages
+        self.ring = RingBuffer()
+
+        # Background writer for quotes and arbitrage reports
+        self.reporter = ArbitrageReporter(format=report_format)
 
-        # Defines the listener address as the host the program is running on
-        self.listener_address = (socket.gethostbyname(socket.gethostname()), 50000)
+        # Latency histograms of each pipeline stage
+        self.metrics = PipelineMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_server = MetricsServer(self.metrics, metrics_port) \
+            if metrics_port is not None else None
+
+        # Defines the listener addresses as the host the program is running on
+        host = socket.gethostbyname(socket.gethostname())
+        self.listener_addresses = [(host, port + venue if port else 0)
+                                   for venue in range(len(self.publishers))]
+
+        # Renews each subscription before the publisher drops it
+        self.renewals = RenewalScheduler(len(self.publishers), lease)
 
         # Define the start time of the object
         self.start_time = datetime.utcnow()
@@ -60,187 +136,434 @@ class Lab3(object):
         Creates threads to handle subscribing to a procider, and receiving
         messages.
 
-        The run function creates the threads for running the listen and 
-        subscription functions to handle the functionality of the program.
+        The run function binds the listening sockets and subscribes to every
+        publisher, then starts a receiver thread that drains the sockets into
+        the ring buffer, and a compute thread that processes everything in the
+        ring before each detection.
         """
 
-        # Run subcription function to connect with publisher
-        self.subscription()
+        # Read the bus, or bind a listening socket for each venue with a large
+        # receive buffer
+        if self.bus_reader is not None:
+            self.receiver = BusReceiver(self.bus_reader, self.ring, self.metrics)
+        else:
+            self.receiver = BatchReceiver(self.listener_addresses, self.ring, RCVBUF_SIZE,
+                                          self.metrics)
+            self.listener_addresses = self.receiver.addresses
+
+        # Run subcription function to connect with each publisher
+        for venue in range(len(self.publishers)):
+            self.subscription(venue)
 
-        # Create threads for the listen functions
-        listener_thread = threading.Thread(target = self.listen)
+        # Start writing reports and serving metrics in the background
+        self.reporter.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+
+        # Create threads for the receiver and compute stages
+        receiver_thread = threading.Thread(target = self.receive)
+        compute_thread = threading.Thread(target = self.compute)
 
         # Start the threads
-        listener_thread.start()
+        receiver_thread.start()
+        compute_thread.start()
 
 
+    def stop(self):
+        """
+        Asks the receiver and compute threads to finish.
+        """
+
+        self.stopped.set()
+
     def check_expiry(self):
         """
-        Determines if the time elapsed is greater than the subscription time
+        Determines if the program should keep running, which is until it is
+        stopped or the run duration has elapsed.
         """
 
+        if self.stopped.is_set():
+            return False
+
         # Returns True if the amount of time passed since object creation is 
-        # less than the subscription time
-        return SUBSCRIPTION_EXPIRY > (datetime.utcnow() - self.start_time).total_seconds() 
+        # less than the run duration
+        return self.duration is None or \
+            self.duration > (datetime.utcnow() - self.start_time).total_seconds()
 
-    def listen(self):
-        """
-        Creates a connection to receive messages, and processes it
-
-        The listen function creates a UDP socket connection to receive messages.
-        When a message is received, the byte stream is processed and converted
-        into a node on a graph. The graph is then passed into a Bellman-Ford
-        algortithm function to determine if a negative cycle is found. When 
-        found, the graph is passed to another function to determine the value
-        of an arbitrage.
+    def receive(self):
         """
+        Receives messages from every venue, and queues them.
 
-        # Create a listening socket using UDP
-        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        listener.bind(self.listener_address)
+        The receive function is the receiver stage of the pipeline. On each
+        wakeup of the selector it drains every ready datagram from the venue
+        sockets into the buffers of the ring without waiting on the compute
+        stage. Datagrams that do not fit in the ring are counted as dropped.
 
-        # Initialize time for logging purposes
-        log_time = datetime.now() + (datetime.utcnow() - datetime.now())
+        Subscriptions are renewed before they expire, and venues that have
+        gone silent are resubscribed, without touching the graph, so the
+        quotes already held stay warm across renewals.
+        """
 
-        # Loop while subscription time is valid
+        # Loop while the program is running
         while self.check_expiry():
-            # Recieve message from publisher and unmarshal data
-            incoming = listener.recv(BUFFER_SIZE)
-            message = subscriber.unmarshal_message(incoming)
+            # Hand the ready datagrams to the compute stage
+            venues = self.receiver.poll(RECV_TIMEOUT)
+            now = time.monotonic()
+
+            # Subscriptions of a bus are kept alive by its daemon
+            if self.bus_reader is not None:
+                continue
 
-            # Traverse message to separate quotes from publisher
-            for quote in message:
-                # Set timestamp for quote
-                timestamp = quote['timestamp']
+            # Track when each venue last delivered quotes
+            for venue in venues:
+                self.renewals.received(venue, now)
+
+            # Keep every subscription alive
+            for venue in self.renewals.due(now):
+                self.subscription(venue)
+
+        # Display how many bus records were read or lost
+        if self.bus_reader is not None:
+            print('Bus stats: {}'.format(self.bus_reader.stats()))
+
+        self.receiver.close()
+
+        # Display how often each feed was renewed or interrupted
+        for venue, stats in enumerate(self.renewals.stats()):
+            print('Feed {}: {}'.format(self.venues[venue], stats))
+
+        return  # Return to end thread
 
-                # Compare time difference to message buffer to determine
-                # sequence of data
-                if (log_time - timestamp).total_seconds() < MSG_BUFFER:
-                    # Parse currency string from quote
-                    money = quote['cross'].split('/')
+    def compute(self):
+        """
+        Processes queued messages, and runs the arbitrage detection.
 
-                    # Display timestamp, currencies, and price
-                    print('['+ str(datetime.now()) +'] {} {} {}'.format(money[0], money[1], quote['price']))
+        The compute function is the compute stage of the pipeline. It drains
+        all datagrams waiting in the ring buffer and coalesces their quotes so
+        only the latest quote for each cross is added to the graph. The graph
+        is then passed into a Bellman-Ford algortithm function once per batch
+        to determine if a negative cycle is found. When found, the graph is
+        passed to another function to determine the value of an arbitrage.
 
-                    # Add currencies and price to graph node
-                    self.add_node(money, quote)
+        The time spent in each stage is recorded in the metrics, and a
+        summary is reported every METRICS_INTERVAL seconds.
+        """
 
-                    # Reset log_time
-                    log_time = quote['timestamp']
+        metrics = self.metrics
+        clock = time.perf_counter
+        next_summary = time.monotonic() + METRICS_INTERVAL
 
-                else:
-                    # Display message ignoring duplicate messages
-                    print('Ignoring out-of-sequence message')
+        # Loop while the program is running
+        while self.check_expiry():
+            # Take every datagram received since the last detection run
+            batch = self.ring.drain(RECV_TIMEOUT)
+            arrival = self.ring.first_arrival
+            latest = {}     # Latest accepted quote for each venue and cross
+
+            # Time spent waiting in the ring by the oldest datagram
+            if arrival is not None:
+                metrics.record('queue', time.monotonic() - arrival)
+
+            unmarshal_time = 0.0
+            sequencing_time = 0.0
+
+            for venue, incoming in batch:
+                # Unmarshal data from the publisher
+                start = clock()
+                message = self.unmarshal(incoming)
+                decoded = clock()
+                unmarshal_time += decoded - start
+
+                # Traverse message to separate quotes from publisher
+                for timestamp, cross, price in message:
+                    # Compare with the newest quote for the same cross to
+                    # determine sequence of data
+                    if self.sequencer.accept((venue, cross), timestamp):
+                        # Report timestamp, venue, cross, and price, leaving
+                        # the formatting of the timestamp to the reporter
+                        self.reporter.report({'type': 'quote', 'cross': cross,
+                                              'price': price,
+                                              'venue': self.venues[venue],
+                                              'timestamp': timestamp})
+
+                        # Keep only the newest quote for the venue and cross
+                        latest[(venue, cross)] = (timestamp, price)
+
+                    else:
+                        # Report message ignoring duplicate messages
+                        self.reporter.report({'type': 'ignored', 'cross': cross,
+                                              'timestamp': timestamp})
+
+                sequencing_time += clock() - decoded
+
+            # Return the buffers to the receiver once they have been decoded
+            self.ring.release()
+
+            if batch:
+                metrics.record('unmarshal', unmarshal_time)
+                metrics.record('sequencing', sequencing_time)
+
+            start = clock()
+
+            # Add the coalesced currencies and prices to the graph
+            for (venue, cross), (timestamp, price) in latest.items():
+                self.add_quote(cross.split('/'), timestamp, price, venue)
+
+            if latest:
+                now = clock()
+                metrics.record('graph_update', now - start)
+                start = now
 
             # Call funciton to check for stale quotes
             stale_data = self.manage_nodes()
+            metrics.record('expiry', clock() - start)
+
+            # Report message with number of removed quotes
+            if len(stale_data) > 0:
+                self.reporter.report({'type': 'stale', 'count': len(stale_data)})
 
-            # Display message with number of removed quotes
-            if stale_data > 0:
-                print('Removed {} stale quotes'.format(stale_data))
+            # Only run the detection when the graph has changed
+            if latest or stale_data:
+                self.detect(arrival if arrival is not None else time.monotonic())
 
-            # Call function to perform Bellman-Ford  shortest path anaylsis
-            analysis = Bellman_Ford(self.graph)
+                # Time from the oldest datagram arriving to the end of detection
+                if arrival is not None:
+                    metrics.record('total', time.monotonic() - arrival)
 
-            # Return predecessor and the negative cycle edge, if any
-            distance, pred, neg_cycle = analysis.shortest_paths(DEFAULT_CURRENCY, TOLERANCE)
+            # Report and save the stage latencies periodically
+            if time.monotonic() >= next_summary:
+                next_summary += METRICS_INTERVAL
+                self.report_metrics()
 
-            # Check if negative cycle exists and pass data to arbitrage function
-            if neg_cycle is not None:
-                self.arbitrage(pred, DEFAULT_CURRENCY)
+        # Write the remaining reports before the final messages
+        self.report_metrics()
+        self.reporter.stop()
+        self.stop()
 
-            # Display message if subscription time has elapsed
-            if self.check_expiry() is False:
-                print('Subscription timeout of {} seconds achieved'.format(SUBSCRIPTION_EXPIRY))
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+        # Display message when the run has ended
+        print('Stopped after {} seconds'.format((datetime.utcnow() - self.start_time).total_seconds()))
+        print('Receiver stats: {}'.format(self.ring.stats()))
+        print('Reporter stats: dropped {}, suppressed {}, rejected {}'.format(
+            self.reporter.dropped, self.reporter.suppressed, self.rejected))
 
         return  # Return to end thread
 
-    def add_node(self, money, quote):
+    def report_metrics(self):
+        """
+        Reports the latency summary of every stage, and writes it to the
+        metrics file if one was given.
         """
-        Adds currency pair and price quote nodes to the graph.
+
+        self.reporter.report({'type': 'metrics', 'stages': self.metrics.summary()})
+
+        if self.metrics_file is not None:
+            self.metrics.dump(self.metrics_file)
+
+    def detect(self, arrival):
+        """
+        Runs the Bellman-Ford analysis on the graph, and reports an arbitrage
+        if a negative cycle is found that is profitable enough.
+
+        Each cycle is scored before the reporting step, and cycles whose
+        profit is below min_profit_bps are rejected, so rounding noise in
+        the weights does not turn into arbitrage reports.
+
+        Args:
+            arrival:
+                The monotonic time the oldest datagram of this run arrived
+        """
+
+        start = time.perf_counter()
+
+        # Call function to perform Bellman-Ford  shortest path anaylsis
+        analysis = Bellman_Ford(self.graph)
+
+        # Return predecessor and the negative cycle edge, if any
+        distance, pred, neg_cycle = analysis.shortest_paths(DEFAULT_CURRENCY, TOLERANCE)
+
+        now = time.perf_counter()
+        self.metrics.record('detection', now - start)
+
+        # Nothing to score without a negative cycle
+        if neg_cycle is None:
+            return
+
+        # Score the cycle, and reject it if the profit is marginal
+        records = self.find_cycle(pred, self.graph.id_of(DEFAULT_CURRENCY), neg_cycle)
+        log_return = self.score(records)
+        accepted = math.expm1(log_return) * BASIS_POINTS >= self.min_profit_bps
+
+        start = time.perf_counter()
+        self.metrics.record('scoring', start - now)
+
+        # Pass the profitable cycle to the arbitrage function
+        if accepted:
+            self.arbitrage(records, log_return, arrival)
+            self.metrics.record('report', time.perf_counter() - start)
+        else:
+            self.rejected += 1
+
+    def add_node(self, money, quote, venue=0):
+        """
+        Adds currency pair and price quote edges to the graph.
 
         Args:
             money:
-                The string of the currency pair
+                The pair of currency names of the cross
             quote:
                 The value of the exchange
+            venue:
+                The id of the venue that published the quote
         """
 
-        # Determine the value of the exchange
-        exchange = -math.log(quote['price'])
+        self.add_quote(money, to_seconds(quote['timestamp']), quote['price'], venue)
 
-        # Check if first currency is already in graph
-        if money[0] not in self.graph:
-            # Create new dictionary for the currency
-            self.graph[money[0]] = {}
+    def add_quote(self, money, timestamp, price, venue=0):
+        """
+        Adds currency pair and price edges to the graph.
 
-        # Add price value to currency edge
-        self.graph[money[0]][money[1]] = {'timestamp': quote['timestamp'], 'price': exchange}
+        Args:
+            money:
+                The pair of currency names of the cross
+            timestamp:
+                The time of the quote in seconds since the UNIX epoch
+            price:
+                The exchange rate of the cross
+            venue:
+                The id of the venue that published the quote
+        """
+
+        # Intern the currencies to their ids in the graph
+        u = self.graph.intern(money[0])
+        v = self.graph.intern(money[1])
 
-        # Check if second currecny is already in the graph
-        if money[1] not in self.graph:
-            # Create new dictionary for the currecny
-            self.graph[money[1]] = {}
+        # Upsert the edge and its inverse with the -log(price) weights
+        self.graph.add_quote(u, v, price, timestamp, venue)
 
-        # Add the inverse price value to the inverse currecny edge
-        self.graph[money[1]][money[0]] = {'timestamp': quote['timestamp'], 'price': -exchange}
+        # Schedule both edges to expire together
+        self.expiry.push(u, v, timestamp, venue)
+        self.expiry.push(v, u, timestamp, venue)
     
-    def manage_nodes(self):
+    def manage_nodes(self, now=None):
         """
         Removes stale price quotes from graph, based on the time to live for
         a published quotes.
 
+        Only the edges whose deadlines have passed are visited, so the cost is
+        the number of expired quotes rather than the size of the graph.
+
+        Args:
+            now:
+                The time in seconds since the UNIX epoch to expire quotes
+                at, or None for the current time
+
         Return:
-            The number of removed nodes from the graph
+            The list of (u, v) id pairs of edges removed from the graph
         """
 
-        # Deterimine cutoff time based on expiry time
-        cutoff = datetime.utcnow() - timedelta(seconds = QUOTE_EXPIRY)
-        count = 0   # Hold the number of expired quotes
+        if now is None:
+            now = to_seconds(datetime.utcnow())
 
-        # Traverse through the list representation of the graph
-        for one in list(self.graph):
-            for two in list(self.graph[one]):
-                # Compare timestamp within graph to cutoff time
-                if self.graph[one][two]['timestamp'] <= cutoff:
-                    del self.graph[one][two]    # Remove node from graph
-                    count += 1                  # Increment count
+        # Expire every edge with a deadline at or before now
+        return self.expiry.expire(now)
 
-        return count
-
-    def arbitrage(self, pred, money):
+    def find_cycle(self, pred, money, neg_cycle) -> list:
         '''
-        Determine the arbirtage amount using the precessor currency and 
-        specified currency.
+        Follows the predecessors from a negative cycle edge to list the
+        currencies of the cycle.
 
         Args:
             pred:
-                The dictionary of predecessor nodes in the graph
+                The list of predecessor ids of vertices in the graph
             money:
-                The initial currency used for the aribtrage
+                The id of the initial currency used for the aribtrage, where
+                the cycle starts if the currency is part of it
+            neg_cycle:
+                The (u, v) edge of the negative cycle found by Bellman-Ford
+
+        Return:
+            The list of currency ids along the cycle, starting and ending
+            with the same currency
         '''
 
+        # Walk back from the edge as many steps as there are vertices, which
+        # always ends on the cycle even when the edge only leads into it
+        pred[neg_cycle[1]] = neg_cycle[0]
+        cycle_start = neg_cycle[1]
+        for _ in range(len(pred)):
+            cycle_start = pred[cycle_start]
+
+        # Start from the initial currency if it is on the cycle
+        last_record = pred[cycle_start]
+        while not (last_record == cycle_start or last_record == money):
+            last_record = pred[last_record]
+        cycle_start = last_record
+
         # Create starting points to traverse dictionary
-        records =  [money]          # List for currencies
-        last_record = pred[money]   # The entry for the inital currency
+        records =  [cycle_start]            # List for currencies
+        last_record = pred[cycle_start]     # The entry for the inital currency
 
         # Traverse list from end and add last node to the records list
-        while not last_record == money:
+        while not last_record == cycle_start:
             records.append(last_record)
             last_record = pred[last_record]
 
         # Add the intial currecny to the list
-        records.append(money)
+        records.append(cycle_start)
 
         # Reverse the list to get starting and ending values
         records.reverse()
 
-        # Display Arbitrage message
-        print("ARBITRAGE\n\tstart with 100 {}".format(money))
+        return records
+
+    def score(self, records) -> float:
+        '''
+        Scores a cycle by the log of the amount it returns for each unit
+        traded, which is the negated sum of the -log(price) weights along it.
+
+        The weights are summed with math.fsum, which is exact to the last
+        bit, so long cycles through many currencies do not pick up rounding
+        error on the way around.
+
+        Args:
+            records:
+                The list of currency ids along the cycle
+
+        Return:
+            The log return of the cycle, positive for a profit
+        '''
+
+        get_weight = self.graph.get_weight
+
+        return -math.fsum(get_weight(records[i - 1], records[i])
+                          for i in range(1, len(records)))
+
+    def arbitrage(self, records, log_return, arrival):
+        '''
+        Determine the arbirtage amount along a scored cycle, and hand it to
+        the reporter.
+
+        Args:
+            records:
+                The list of currency ids along the cycle
+            log_return:
+                The log return of the cycle from score
+            arrival:
+                The monotonic time the oldest datagram of this run arrived
+        '''
+
+        graph = self.graph
+        cycle_start = records[0]
 
         # Initalize starting amount and currency
         value = STARTING_AMOUNT
-        last = money
+        last = cycle_start
+        rates = []      # Exchange rate of each hop
+        values = []     # Amount held after each hop
+        venues = []     # Venue quoting each hop
 
         # Traverse records list
         for i in range(1, len(records)):
@@ -248,49 +571,123 @@ class Lab3(object):
             current = records[i]
 
             # Convert stored price into exchange rate between the currencies
-            price = math.exp(-1 * self.graph[last][current]['price'])
+            price = math.exp(-1 * graph.get_weight(last, current))
             value *= price  # Update the value of the trade
 
-            # Display exchange information
-            print("\texchange {} for {} at {} --> {} {}".format(last, current, price, value, current))
+            # Record exchange information
+            rates.append(price)
+            values.append(value)
+            venues.append(self.venues[graph.venue[graph.edge(last, current)]])
             last = current  # Reset pointer for next iteration
         
-        # Display result of arbitrage
-        print('\t-> profit of {} {}'.format(value - STARTING_AMOUNT, money))
-
-    def subscription(self):
+        # Report result of arbitrage, with the profit taken from the score
+        self.reporter.report({'type': 'arbitrage',
+                              'cycle': [graph.name(id) for id in records],
+                              'rates': rates, 'values': values, 'venues': venues,
+                              'start': STARTING_AMOUNT,
+                              'profit': STARTING_AMOUNT * math.expm1(log_return),
+                              'profit_bps': math.expm1(log_return) * BASIS_POINTS,
+                              'latency': time.monotonic() - arrival})
+
+    def subscription(self, venue=0):
         '''
-        Creates connection with publisher by sending message with serialized
-        address.
+        Creates connection with a publisher by sending message with the
+        serialized address of the venue's listening socket.
+
+        Args:
+            venue:
+                The id of the venue to subscribe to
         '''
 
+        publisher = self.publishers[venue]
+
         # Display connection to publisher message
-        print('Connecting to {}'.format(self.publisher))
+        print('Connecting to {}'.format(publisher))
 
         # Create socket using UDP
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as connection:
             # Serialize address for sending to publisher
-            address = subscriber.serialize_address(self.listener_address)
+            address = subscriber.serialize_address(self.listener_addresses[venue])
 
             # Send serialized message
-            connection.sendto(address, self.publisher)
+            connection.sendto(address, publisher)
 
             # Close connection
             connection.close()
 
+        self.renewals.subscribed(venue, time.monotonic())
+
+
+def unmarshal_quotes(incoming) -> list:
+    """
+    Unmarshals a datagram of wire records into quotes.
+
+    Args:
+        incoming:
+            The bytes or memoryview of a datagram from a publisher
+
+    Returns:
+        The list of (timestamp in seconds, cross, price) tuples
+    """
+
+    return [(to_seconds(quote['timestamp']), quote['cross'], quote['price'])
+            for quote in subscriber.unmarshal_message(incoming)]
+
+def parse_address(text) -> tuple:
+    '''
+    Parses a HOST:PORT command line argument into an address.
+
+    Args:
+        text:
+            The host and port separated by a colon
+
+    Return:
+        The host, port tuple
+    '''
+
+    host, _, port = text.rpartition(':')
+
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError('expected HOST:PORT, got {}'.format(text))
+
+    return host, int(port)
+
 
 # Main Function
 if __name__ == '__main__':
-    # Check length of command line arguements
-    if len(sys.argv) != 3:
-        print("Usage: python3 lab3.py PUBLISHER_HOST PUBLISHER_PORT")
-        exit(1)
-    
-    # Set address based on host and port based from the command line arguemnts
-    address = (sys.argv[1], int(sys.argv[2]))
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Detect arbitrage across Forex Provider feeds')
+    parser.add_argument('publishers', nargs='*', type=parse_address, metavar='HOST:PORT',
+                        help='address of a publisher to subscribe to')
+    parser.add_argument('--bus', default=None,
+                        help='name of a quote bus to read instead of subscribing')
+    parser.add_argument('--format', choices=(TEXT, 'json'), default=TEXT,
+                        help='report output format')
+    parser.add_argument('--port', type=int, default=LISTENER_PORT,
+                        help='first port to receive quotes on, 0 for free ports')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='seconds to run for, default is until interrupted')
+    parser.add_argument('--lease', type=float, default=SUBSCRIPTION_EXPIRY,
+                        help='seconds the publishers keep a subscription')
+    parser.add_argument('--metrics-file', default=None,
+                        help='JSON file to write stage latencies to')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='local port to serve stage latencies on')
+    parser.add_argument('--min-profit-bps', type=float, default=MIN_PROFIT_BPS,
+                        help='smallest cycle profit in basis points to report')
+    args = parser.parse_args()
+
+    if bool(args.publishers) == (args.bus is not None):
+        parser.error('give either publishers or --bus')
 
     # Create Lab3 object
-    lab3 = Lab3(address)
-
-    # Call run function
-    lab3.run()
\ No newline at end of file
+    lab3 = Lab3(args.publishers, args.format, args.port, args.duration, args.lease,
+                args.metrics_file, args.metrics_port, args.min_profit_bps, args.bus)
+
+    # Call run function, and stop the threads on Ctrl-C
+    lab3.run()
+    try:
+        while not lab3.stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        lab3.stop()
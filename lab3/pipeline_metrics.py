@@ -0,0 +1,306 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: pipeline_metrics.py
+
+Low overhead latency instrumentation for the arbitrage pipeline. Each stage
+records its durations into a LatencyHistogram, an HDR-style histogram with
+log-linear buckets: values are whole microseconds, every power of two is
+split into 2**SUB_BUCKET_BITS equal buckets, and recording a value is a few
+integer operations and one array increment. Percentiles read from it are
+within about 1 / 2**SUB_BUCKET_BITS of the true value.
+
+PipelineMetrics holds a histogram per stage and produces summaries with
+percentiles, which can be written to a JSON file or served as JSON from a
+local HTTP endpoint by a MetricsServer.
+
+>>> histogram = LatencyHistogram()
+>>> for micros in range(1, 1001):
+...     histogram.record(micros / 1e6)
+>>> histogram.count, histogram.max
+(1000, 1000)
+>>> 490 <= histogram.percentile(50) <= 510
+True
+"""
+
+import json
+import os
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BUCKET_BITS = 5     # Buckets per power of two are 2**SUB_BUCKET_BITS
+MAX_VALUE_BITS = 40     # Largest value is 2**40 microseconds, about 12 days
+PERCENTILES = (50, 90, 99, 99.9)    # Percentiles reported in a summary
+MICROS_PER_SECOND = 1_000_000       # Constant for microseconds in a second
+
+# Stages of the pipeline, in the order a datagram passes through them
+STAGES = ('recv', 'queue', 'unmarshal', 'sequencing', 'graph_update', 'expiry',
+          'detection', 'scoring', 'report', 'total')
+
+def format_summary(summary) -> str:
+    """
+    Formats a PipelineMetrics summary as a table with one line per stage, in
+    microseconds.
+
+    Args:
+        summary:
+            The dictionary of stage summaries
+
+    Returns:
+        The table as a string
+    """
+
+    columns = ['p{}'.format(percent) for percent in PERCENTILES] + ['max']
+    lines = ['{:<13}{:>9}'.format('stage (us)', 'count') +
+             ''.join('{:>9}'.format(column) for column in columns)]
+
+    for stage, stats in summary.items():
+        lines.append('{:<13}{:>9}'.format(stage, stats['count']) +
+                     ''.join('{:>9}'.format(stats[column]) for column in columns))
+
+    return '\n'.join(lines)
+
+class LatencyHistogram(object):
+    """
+    LatencyHistogram counts durations in log-linear microsecond buckets.
+    """
+
+    def __init__(self) -> None:
+        """
+        The LatencyHistogram constructor preallocates the bucket counts.
+        """
+
+        sub_buckets = 1 << SUB_BUCKET_BITS
+        self.counts = array('Q', [0]) * ((MAX_VALUE_BITS - SUB_BUCKET_BITS + 1) * sub_buckets)
+        self.count = 0      # Number of values recorded
+        self.total = 0      # Sum of the values in microseconds
+        self.min = None     # Smallest value in microseconds
+        self.max = 0        # Largest value in microseconds
+
+    @staticmethod
+    def bucket(micros) -> int:
+        """
+        Returns the index of the bucket holding a value.
+
+        Args:
+            micros:
+                The value in whole microseconds
+
+        Returns:
+            The bucket index
+        """
+
+        # Small values map one to one, larger ones drop their low bits
+        shift = max(micros.bit_length() - SUB_BUCKET_BITS - 1, 0)
+        return (shift << SUB_BUCKET_BITS) + (micros >> shift)
+
+    @staticmethod
+    def bucket_value(index) -> int:
+        """
+        Returns the highest value that falls into a bucket.
+
+        Args:
+            index:
+                The bucket index
+
+        Returns:
+            The value in microseconds
+        """
+
+        sub_buckets = 1 << SUB_BUCKET_BITS
+
+        # The first two powers of two worth of buckets hold one value each
+        if index < 2 * sub_buckets:
+            return index
+
+        # Later buckets each span 2**shift values of one power of two
+        shift = (index >> SUB_BUCKET_BITS) - 1
+        top = (index & (sub_buckets - 1)) + sub_buckets
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Records a duration.
+
+        Args:
+            seconds:
+                The duration in seconds
+        """
+
+        micros = min(int(seconds * MICROS_PER_SECOND), (1 << MAX_VALUE_BITS) - 1)
+        if micros < 0:
+            micros = 0
+
+        self.counts[self.bucket(micros)] += 1
+        self.count += 1
+        self.total += micros
+
+        if self.min is None or micros < self.min:
+            self.min = micros
+        if micros > self.max:
+            self.max = micros
+
+    def percentile(self, percent) -> int:
+        """
+        Returns the value at or below which the given percent of the recorded
+        values fall.
+
+        Args:
+            percent:
+                The percentile, from 0 to 100
+
+        Returns:
+            The value in microseconds, or 0 if nothing was recorded
+        """
+
+        if self.count == 0:
+            return 0
+
+        target = max(1, -(-self.count * percent // 100))
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_value(index), self.max)
+
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Returns the count, mean, min, max and percentiles in microseconds.
+        """
+
+        summary = {'count': self.count,
+                   'mean': self.total / self.count if self.count else 0,
+                   'min': self.min or 0, 'max': self.max}
+
+        for percent in PERCENTILES:
+            summary['p{}'.format(percent)] = self.percentile(percent)
+
+        return summary
+
+class PipelineMetrics(object):
+    """
+    PipelineMetrics keeps a LatencyHistogram for every stage of the pipeline.
+    """
+
+    def __init__(self, stages=STAGES) -> None:
+        """
+        The PipelineMetrics constructor creates a histogram for each stage.
+
+        Args:
+            stages:
+                The names of the stages to time
+        """
+
+        self.stages = tuple(stages)
+        self.histograms = {stage: LatencyHistogram() for stage in self.stages}
+
+    def record(self, stage, seconds):
+        """
+        Records the duration of one pass through a stage.
+
+        Args:
+            stage:
+                The name of the stage
+            seconds:
+                The duration in seconds
+        """
+
+        self.histograms[stage].record(seconds)
+
+    def summary(self) -> dict:
+        """
+        Returns the summary of every stage that has recorded a value, keyed
+        by stage name.
+        """
+
+        return {stage: self.histograms[stage].summary() for stage in self.stages
+                if self.histograms[stage].count}
+
+    def format_summary(self) -> str:
+        """
+        Formats the summary as a table with one line per stage.
+        """
+
+        return format_summary(self.summary())
+
+    def dump(self, path):
+        """
+        Writes the summary to a JSON file, replacing it atomically.
+
+        Args:
+            path:
+                The file name to write to
+        """
+
+        temp = path + '.tmp'
+        with open(temp, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+        os.replace(temp, path)
+
+class MetricsServer(object):
+    """
+    MetricsServer serves the summary of a PipelineMetrics as JSON over HTTP
+    on a local port.
+    """
+
+    def __init__(self, metrics, port, host='localhost') -> None:
+        """
+        The MetricsServer constructor binds the HTTP server.
+
+        Args:
+            metrics:
+                The PipelineMetrics to serve
+            port:
+                The port to listen on
+            host:
+                The host to listen on, localhost by default
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Answers every GET with the current summary """
+
+            def do_GET(self):
+                body = json.dumps(metrics.summary()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # Keep requests off the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> tuple:
+        """
+        Returns the host, port pair the server is bound to.
+        """
+
+        return self.server.server_address
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        """
+
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
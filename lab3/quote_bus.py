@@ -0,0 +1,543 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: quote_bus.py
+
+A shared memory quote bus for subscribers running on the same host. One
+QuoteBusDaemon subscribes to the publishers and receives the feed once, then
+writes every quote into a ring of 32-byte records in a
+multiprocessing.shared_memory segment. Any number of QuoteBusReaders, such as
+Lab3 started with --bus, attach to the segment by name and read the records
+without a socket of their own, and unpack_quotes turns a run of them into
+quotes with a single struct call.
+
+Records keep the layout described in fxp_bytes_subscriber, except that the
+daemon converts the timestamp once for every reader, and the reserved bytes
+carry the bus metadata. Multi-byte fields are little-endian:
+
+    Bytes[0:8]   Timestamp in seconds since the UNIX epoch, as a float
+    Bytes[8:14]  Currency names, as in the wire record
+    Bytes[14:22] Exchange rate, as in the wire record
+    Bytes[22:30] Sequence number of the record, starting at 1
+    Bytes[30:32] Id of the venue the record was received from, below MAX_VENUES
+
+The segment starts with a HEADER_SIZE header holding a magic string, the
+capacity in records, the number of venues, and the count of records written,
+which the daemon updates after each datagram's records are in place.
+
+Each reader keeps its own cursor. A reader that falls more than the capacity
+behind has been overrun: it skips to the oldest record still held and counts
+the records it lost. While copying, the writer may lap the reader, so the
+sequence number of the first copied record is checked again afterwards, and
+the copy is discarded as an overrun if it changed. The writer clears a
+record's sequence number before rewriting it to make that check reliable.
+
+>>> bus = QuoteBus(capacity=4, venues=2)
+>>> reader = QuoteBusReader(bus.name)
+>>> record = (1500000).to_bytes(8, 'big') + b'GBPUSD' + struct.pack('<d', 1.25) + bytes(10)
+>>> bus.write(record * 3, venue=1)
+3
+>>> buffer = bytearray(32 * 50)
+>>> reader.read_into(buffer), reader.cursor
+((3, 1), 3)
+>>> unpack_quotes(memoryview(buffer)[:32 * 3])[0]
+(1.5, 'GBP/USD', 1.25)
+>>> bus.write(record * 6)
+6
+>>> reader.read_into(buffer), reader.lost, reader.cursor
+((3, 0), 2, 8)
+>>> bus.write(record, venue=1000)
+Traceback (most recent call last):
+    ...
+ValueError: venue 1000 is not on the bus
+>>> reader.close(); bus.close(); bus.unlink()
+"""
+
+import argparse
+import struct
+import socket
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import fxp_bytes_subscriber as subscriber
+from fxp_bytes_subscriber import MAX_QUOTES_PER_MESSAGE, MICROS_PER_SECOND, RECORD_LENGTH
+from quote_pipeline import RingBuffer
+from quote_receiver import BatchReceiver
+from subscription_renewal import LEASE, RenewalScheduler
+
+MAGIC = b'FXQBUS01'         # Marks a segment written by a QuoteBus
+HEADER = struct.Struct('<8sQQQ')    # Magic, capacity, venues, records written
+HEADER_SIZE = 64            # Bytes reserved for the header
+WRITTEN_OFFSET = 24         # Offset of the records written in the header
+COUNT = struct.Struct('<Q') # Format of the records written and sequence numbers
+QUOTE = struct.Struct('<d6sdQH')    # Timestamp, currencies, price, sequence, venue
+WIRE_TIME = struct.Struct('>Q')     # Timestamp of a wire record in microseconds
+TIME = struct.Struct('<d')  # Timestamp of a bus record in seconds
+VENUE = struct.Struct('<H') # Format of the venue id
+MAX_VENUES = 1 << 16        # Venues a venue id can tell apart
+SEQUENCE_OFFSET = 22        # Offset of the sequence number in a record
+VENUE_OFFSET = 30           # Offset of the venue id in a record
+DEFAULT_CAPACITY = 1 << 16  # Records held by the ring, 2 MB of records
+POLL_INTERVAL = 0.001       # Seconds between checks of the bus for records
+RECV_TIMEOUT = 0.5          # Seconds between renewal checks of the daemon
+
+created = set()     # Names of the segments created by this process
+
+class QuoteBus(object):
+    """
+    QuoteBus creates the shared memory segment and writes records into it.
+    There is one writer for each bus.
+    """
+
+    def __init__(self, name=None, capacity=DEFAULT_CAPACITY, venues=1) -> None:
+        """
+        The QuoteBus constructor creates the segment and writes the header.
+
+        Args:
+            name:
+                The name of the shared memory segment, or None for a random
+                name
+            capacity:
+                The number of records the ring holds
+            venues:
+                The number of venues whose records are written, at most
+                MAX_VENUES
+        """
+
+        if not 0 < venues <= MAX_VENUES:
+            raise ValueError('a bus holds 1 to {} venues, not {}'.format(MAX_VENUES, venues))
+
+        self.shm = shared_memory.SharedMemory(name, create=True,
+                                              size=HEADER_SIZE + capacity * RECORD_LENGTH)
+        created.add(self.shm.name)
+        self.buf = self.shm.buf
+        self.capacity = capacity
+        self.venues = venues
+        self.written = 0    # Records written so far, the last sequence number
+
+        HEADER.pack_into(self.buf, 0, MAGIC, capacity, venues, 0)
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the name readers attach to.
+        """
+
+        return self.shm.name
+
+    def write(self, datagram, venue=0) -> int:
+        """
+        Appends the records of a datagram to the ring, with their timestamps
+        converted to seconds, then publishes the new count of records written.
+
+        Args:
+            datagram:
+                The bytes or memoryview of whole 32-byte wire records
+            venue:
+                The id of the venue the datagram came from
+
+        Returns:
+            The number of records written
+        """
+
+        if not 0 <= venue < self.venues:
+            raise ValueError('venue {} is not on the bus'.format(venue))
+
+        buf = self.buf
+        count = len(datagram) // RECORD_LENGTH
+
+        for i in range(count):
+            sequence = self.written + 1
+            offset = HEADER_SIZE + (self.written % self.capacity) * RECORD_LENGTH
+            record = i * RECORD_LENGTH
+
+            # Invalidate the old record before overwriting it
+            COUNT.pack_into(buf, offset + SEQUENCE_OFFSET, 0)
+            buf[offset:offset + SEQUENCE_OFFSET] = datagram[record:record + SEQUENCE_OFFSET]
+            VENUE.pack_into(buf, offset + VENUE_OFFSET, venue)
+
+            # Convert the timestamp once for every reader
+            seconds = WIRE_TIME.unpack_from(datagram, record)[0] / MICROS_PER_SECOND
+            TIME.pack_into(buf, offset, seconds)
+            COUNT.pack_into(buf, offset + SEQUENCE_OFFSET, sequence)
+
+            self.written = sequence
+
+        COUNT.pack_into(buf, WRITTEN_OFFSET, self.written)
+        return count
+
+    def close(self):
+        """
+        Detaches from the segment.
+        """
+
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Removes the segment, once every process is done with it.
+        """
+
+        self.shm.unlink()
+
+class QuoteBusReader(object):
+    """
+    QuoteBusReader follows the records of a bus from its own cursor.
+    """
+
+    def __init__(self, name) -> None:
+        """
+        The QuoteBusReader constructor attaches to the segment and starts
+        reading at the next record written.
+
+        Args:
+            name:
+                The name of the shared memory segment of the bus
+        """
+
+        self.shm = attach(name)
+        self.buf = self.shm.buf
+
+        magic, self.capacity, self.venues, written = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a quote bus'.format(name))
+
+        self.cursor = written   # Records read or skipped so far
+
+        # Counters
+        self.read = 0       # Records read
+        self.overruns = 0   # Times the writer lapped the reader
+        self.lost = 0       # Records skipped because of overruns
+
+    def written(self) -> int:
+        """
+        Returns the number of records the writer has published.
+        """
+
+        return COUNT.unpack_from(self.buf, WRITTEN_OFFSET)[0]
+
+    def pending(self) -> int:
+        """
+        Returns the number of records not read yet, overrun or not.
+        """
+
+        return self.written() - self.cursor
+
+    def read_into(self, buffer, limit=MAX_QUOTES_PER_MESSAGE) -> tuple:
+        """
+        Copies the next run of records from one venue into a buffer. A run
+        ends at a change of venue, at the end of the ring, or at the limit.
+
+        Args:
+            buffer:
+                The writable buffer to copy the records into
+            limit:
+                The largest number of records to copy
+
+        Returns:
+            The number of records copied and the id of their venue, with 0
+            records if there was nothing to read or the copy was overrun
+        """
+
+        buf = self.buf
+        capacity = self.capacity
+        written = self.written()
+
+        # Skip to the oldest record still held if the writer lapped us
+        if written - self.cursor > capacity:
+            self.overruns += 1
+            self.lost += written - capacity - self.cursor
+            self.cursor = written - capacity
+
+        slot = self.cursor % capacity
+        first = HEADER_SIZE + slot * RECORD_LENGTH
+        available = min(written - self.cursor, capacity - slot, limit,
+                        len(buffer) // RECORD_LENGTH)
+        if available <= 0:
+            return 0, 0
+
+        # Extend the run while the venue stays the same
+        venue = VENUE.unpack_from(buf, first + VENUE_OFFSET)[0]
+        count = 1
+        while count < available and \
+                VENUE.unpack_from(buf, first + count * RECORD_LENGTH + VENUE_OFFSET)[0] == venue:
+            count += 1
+
+        size = count * RECORD_LENGTH
+        buffer[:size] = buf[first:first + size]
+
+        # The writer overwrites in order, so if the first record is intact
+        # the whole copy is
+        self.cursor += count
+        expected = self.cursor - count + 1
+        if COUNT.unpack_from(buffer, SEQUENCE_OFFSET)[0] != expected or \
+                COUNT.unpack_from(buf, first + SEQUENCE_OFFSET)[0] != expected:
+            self.overruns += 1
+            self.lost += count
+            return 0, 0
+
+        self.read += count
+        return count, venue
+
+    def stats(self) -> dict:
+        """
+        Returns the reader counters.
+        """
+
+        return {'read': self.read, 'overruns': self.overruns, 'lost': self.lost,
+                'pending': self.pending()}
+
+    def close(self):
+        """
+        Detaches from the segment without removing it.
+        """
+
+        self.buf = None
+        self.shm.close()
+
+class BusReceiver(object):
+    """
+    BusReceiver moves records from a bus into a RingBuffer, standing in for
+    the BatchReceiver of a subscriber that reads the bus instead of sockets.
+    """
+
+    def __init__(self, reader, ring, metrics=None) -> None:
+        """
+        The BusReceiver constructor sets the reader and the ring to fill.
+
+        Args:
+            reader:
+                The QuoteBusReader to read records from
+            ring:
+                The RingBuffer to fill with runs of records
+            metrics:
+                The PipelineMetrics to record the time spent receiving in,
+                or None
+        """
+
+        self.reader = reader
+        self.ring = ring
+        self.metrics = metrics
+
+    @property
+    def addresses(self) -> list:
+        """
+        Returns no addresses, since nothing is received over sockets.
+        """
+
+        return []
+
+    def poll(self, timeout=None) -> list:
+        """
+        Waits for records on the bus, then copies every pending record into
+        the ring, one slot for each run.
+
+        Args:
+            timeout:
+                The longest time to wait in seconds, or None to wait forever
+
+        Returns:
+            The list of ids of the venues that delivered records
+        """
+
+        reader = self.reader
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        # Shared memory cannot be selected on, so check it periodically
+        while reader.pending() == 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            time.sleep(POLL_INTERVAL)
+
+        ring = self.ring
+        venues = set()
+        start = time.perf_counter()
+
+        while reader.pending():
+            # Leave the records on the bus while the ring is full
+            index = ring.acquire()
+            if index is None:
+                break
+
+            count, venue = reader.read_into(ring.slots[index])
+            if count == 0:
+                continue    # The run was overrun while copying
+
+            ring.commit(index, count * RECORD_LENGTH, venue)
+            venues.add(venue)
+
+        if venues and self.metrics is not None:
+            self.metrics.record('recv', time.perf_counter() - start)
+
+        return sorted(venues)
+
+    def close(self):
+        """
+        Detaches the reader from the bus.
+        """
+
+        self.reader.close()
+
+class QuoteBusDaemon(object):
+    """
+    QuoteBusDaemon subscribes to the publishers once for the whole host and
+    writes their feeds to a QuoteBus.
+    """
+
+    def __init__(self, publishers, name=None, capacity=DEFAULT_CAPACITY, port=0,
+                 lease=LEASE) -> None:
+        """
+        The QuoteBusDaemon constructor binds a socket for each publisher and
+        creates the bus.
+
+        Args:
+            publishers:
+                The list of publisher addresses, in venue id order
+            name:
+                The name of the shared memory segment, or None for a random
+                name
+            capacity:
+                The number of records the bus holds
+            port:
+                The port to receive the first venue on, with one more for each
+                venue after it, or 0 to pick free ports
+            lease:
+                The number of seconds the publishers keep a subscription
+        """
+
+        self.publishers = list(publishers)
+        self.ring = RingBuffer()
+        host = socket.gethostbyname(socket.gethostname())
+        self.receiver = BatchReceiver([(host, port + venue if port else 0)
+                                       for venue in range(len(self.publishers))], self.ring)
+        self.bus = QuoteBus(name, capacity, len(self.publishers))
+        self.renewals = RenewalScheduler(len(self.publishers), lease)
+
+    def subscribe(self, venue):
+        """
+        Sends a subscription request for a venue's socket to its publisher.
+
+        Args:
+            venue:
+                The id of the venue to subscribe to
+        """
+
+        address = subscriber.serialize_address(self.receiver.addresses[venue])
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as connection:
+            connection.sendto(address, self.publishers[venue])
+
+        self.renewals.subscribed(venue, time.monotonic())
+
+    def run(self, duration=None):
+        """
+        Receives the feeds and writes them to the bus, renewing the
+        subscriptions, until the duration has passed.
+
+        Args:
+            duration:
+                The number of seconds to run for, or None to run forever
+        """
+
+        start = time.monotonic()
+
+        for venue in range(len(self.publishers)):
+            self.subscribe(venue)
+
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                venues = self.receiver.poll(RECV_TIMEOUT)
+                now = time.monotonic()
+
+                # Copy each datagram's records to the bus
+                for venue, datagram in self.ring.drain(0):
+                    self.bus.write(datagram, venue)
+                self.ring.release()
+
+                for venue in venues:
+                    self.renewals.received(venue, now)
+                for venue in self.renewals.due(now):
+                    self.subscribe(venue)
+        finally:
+            self.receiver.close()
+
+    def close(self):
+        """
+        Removes the bus.
+        """
+
+        self.bus.close()
+        self.bus.unlink()
+
+def unpack_quotes(records) -> list:
+    """
+    Returns the quotes of a run of bus records.
+
+    Args:
+        records:
+            The bytes or memoryview of whole bus records
+
+    Returns:
+        The list of (timestamp in seconds, cross, price) tuples
+    """
+
+    return [(seconds, '{}/{}'.format(money[:3].decode('ascii'), money[3:].decode('ascii')), price)
+            for seconds, money, price, _, _ in QUOTE.iter_unpack(records)]
+
+def attach(name) -> shared_memory.SharedMemory:
+    """
+    Attaches to an existing segment without letting this process's resource
+    tracker remove it at exit, which only the creator should do.
+
+    Args:
+        name:
+            The name of the segment
+
+    Returns:
+        The SharedMemory
+    """
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python before 3.13 always tracks the segment, so stop tracking it
+        # unless this process created it and will unlink it
+        shm = shared_memory.SharedMemory(name)
+        if shm.name not in created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+# Main Function
+if __name__ == '__main__':
+    from lab3 import parse_address
+
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Share Forex Provider feeds with local subscribers')
+    parser.add_argument('publishers', nargs='+', type=parse_address, metavar='HOST:PORT',
+                        help='address of a publisher to subscribe to')
+    parser.add_argument('--name', default='fxbus', help='name of the shared memory segment')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                        help='records held by the bus')
+    parser.add_argument('--port', type=int, default=0,
+                        help='first port to receive quotes on, 0 for free ports')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='seconds to run for, default is until interrupted')
+    parser.add_argument('--lease', type=float, default=LEASE,
+                        help='seconds the publishers keep a subscription')
+    args = parser.parse_args()
+
+    daemon = QuoteBusDaemon(args.publishers, args.name, args.capacity, args.port, args.lease)
+    print('Writing {} feeds to bus {}'.format(len(args.publishers), daemon.bus.name))
+
+    try:
+        daemon.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
@@ -0,0 +1,126 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: quote_expiry.py
+
+Drives the expiry of stale quotes in a QuoteGraph from a min-heap of edge
+deadlines, so that handling a datagram only costs the number of edges that
+actually expired rather than a scan of the whole graph.
+
+Refreshing an edge pushes a new deadline without searching for the old one.
+The old entry is left in the heap and skipped when it is popped, since its
+timestamp no longer matches the edge in the graph.
+
+>>> from quote_graph import QuoteGraph
+>>> graph = QuoteGraph()
+>>> usd, gbp = graph.intern('USD'), graph.intern('GBP')
+>>> expiry = ExpiryHeap(graph, 1.5)
+>>> graph.add_quote(gbp, usd, 1.25, 10.0)
+>>> expiry.push(gbp, usd, 10.0); expiry.push(usd, gbp, 10.0)
+>>> expiry.expire(11.0)
+[]
+>>> sorted(expiry.expire(11.5))
+[(0, 1), (1, 0)]
+>>> graph.edge_count
+0
+"""
+
+import heapq
+
+COMPACT_FACTOR = 4  # Rebuild the heap when it holds this many entries per quote
+COMPACT_MINIMUM = 1024  # Never rebuild heaps smaller than this
+
+class ExpiryHeap(object):
+    """
+    ExpiryHeap removes edges from a QuoteGraph once their quotes are older
+    than the time to live.
+    """
+
+    def __init__(self, graph, ttl) -> None:
+        """
+        The ExpiryHeap constructor sets the graph to expire edges from and the
+        time to live of a quote.
+
+        Args:
+            graph:
+                The QuoteGraph holding the edges
+            ttl:
+                The number of seconds a quote stays valid
+        """
+
+        self.graph = graph
+        self.ttl = ttl
+        self.heap = []      # Entries of (deadline, timestamp, u, v, venue)
+
+    def __len__(self):
+        """ The number of deadlines in the heap, including stale ones """
+        return len(self.heap)
+
+    def push(self, u, v, timestamp, venue=0):
+        """
+        Schedules the quote of a venue for the edge from u to v to expire ttl
+        seconds after timestamp.
+
+        Args:
+            u:
+                The id of the currency at the start of the edge
+            v:
+                The id of the currency at the end of the edge
+            timestamp:
+                The quote time of the edge in seconds since the epoch
+            venue:
+                The id of the venue that published the quote
+        """
+
+        heapq.heappush(self.heap, (timestamp + self.ttl, timestamp, u, v, venue))
+
+        # Drop superseded deadlines when they outnumber the live edges
+        live = self.graph.edge_count * self.graph.venues
+        if len(self.heap) > max(COMPACT_MINIMUM, COMPACT_FACTOR * live):
+            self.compact()
+
+    def is_current(self, timestamp, u, v, venue) -> bool:
+        """
+        Is the deadline entry still the one for the venue's quote in the graph?
+        """
+
+        return self.graph.quote_time(u, v, venue) == timestamp
+
+    def expire(self, now) -> list:
+        """
+        Removes every quote whose deadline is at or before now. An edge
+        leaves the graph once none of its venues has a quote left.
+
+        Args:
+            now:
+                The current time in seconds since the epoch
+
+        Returns:
+            The list of (u, v) edges that had a quote removed
+        """
+
+        heap = self.heap
+        removed = []
+
+        # Pop deadlines in order until reaching one in the future
+        while heap and heap[0][0] <= now:
+            _, timestamp, u, v, venue = heapq.heappop(heap)
+
+            # Skip entries for quotes refreshed or removed since the push
+            if self.is_current(timestamp, u, v, venue):
+                self.graph.remove(u, v, venue)
+                removed.append((u, v))
+
+        return removed
+
+    def compact(self):
+        """
+        Rebuilds the heap from only the entries that still match the graph.
+        """
+
+        self.heap = [entry for entry in self.heap if self.is_current(*entry[1:])]
+        heapq.heapify(self.heap)
@@ -0,0 +1,447 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: quote_graph.py
+
+An indexed, array-backed graph of currency exchange quotes. Currencies are
+interned to small integer ids, and every edge lives in a slot of a set of
+preallocated parallel arrays:
+
+    src[e], dst[e]      The currency ids at either end of edge e
+    weight[e]           The -log(price) of exchanging src for dst
+    timestamp[e]        The quote time, in seconds since the UNIX epoch
+    venue[e]            The venue whose quote sets the weight
+
+When quotes come from several venues, each edge also keeps the latest quote
+of every venue, and its weight is the lowest -log(price) among them, which
+is the best rate for that direction.
+
+A capacity x capacity matrix of edge indexes gives O(1) lookup of the edge
+between any two currencies, so upserting a quote never allocates. Removing an
+edge moves the last edge into its slot to keep the edge list dense, which
+lets the Bellman-Ford engine walk edges 0..edge_count - 1 directly.
+
+>>> graph = QuoteGraph(4)
+>>> usd, gbp = graph.intern('USD'), graph.intern('GBP')
+>>> graph.add_quote(gbp, usd, 1.25, 10.0)
+>>> graph.edge_count, graph.vertex_count
+(2, 2)
+>>> round(graph.get_weight(usd, gbp), 6) == round(math.log(1.25), 6)
+True
+>>> graph.remove(gbp, usd)
+True
+>>> graph.edge_count, graph.edge(gbp, usd)
+(1, -1)
+>>> graph = QuoteGraph(4, venues=2)
+>>> usd, gbp = graph.intern('USD'), graph.intern('GBP')
+>>> graph.add_quote(gbp, usd, 1.25, 10.0, venue=0)
+>>> graph.add_quote(gbp, usd, 1.30, 10.0, venue=1)
+>>> graph.venue[graph.edge(gbp, usd)], graph.venue[graph.edge(usd, gbp)]
+(1, 0)
+>>> graph.remove(gbp, usd, venue=1), graph.venue[graph.edge(gbp, usd)]
+(True, 0)
+"""
+
+import math
+from array import array
+from datetime import datetime
+
+DEFAULT_CAPACITY = 16       # Initial number of currencies to allocate for
+NO_EDGE = -1                # Marker for an empty slot in the edge matrix
+NO_QUOTE = -math.inf        # Quote time of a venue that has no quote
+EPOCH = datetime(1970, 1, 1)    # UNIX time epoch
+
+def to_seconds(timestamp: datetime) -> float:
+    """
+    Converts a UTC datetime into seconds since the UNIX epoch.
+
+    Args:
+        timestamp:
+            The UTC datetime of a quote
+
+    Returns:
+        The number of seconds since 00:00:00 UTC on 1 January 1970
+    """
+
+    return (timestamp - EPOCH).total_seconds()
+
+class QuoteGraph(object):
+    """
+    QuoteGraph stores the exchange rates between currencies as a dense edge
+    list backed by preallocated arrays.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, venues=1) -> None:
+        """
+        The QuoteGraph constructor allocates the edge arrays and the edge
+        index matrix for the given number of currencies.
+
+        Args:
+            capacity:
+                The number of currencies to allocate space for. The graph
+                grows by doubling if more currencies are interned.
+            venues:
+                The number of venues that can quote each edge
+        """
+
+        self.ids = {}           # Currency name to id
+        self.names = []         # Currency id to name
+        self.edge_count = 0     # Number of edges in use
+        self.capacity = 0       # Number of currencies allocated for
+        self.venues = venues    # Number of venues per edge
+
+        # Edge arrays, filled in by _allocate
+        self.slot = array('l')
+        self.src = array('l')
+        self.dst = array('l')
+        self.weight = array('d')
+        self.timestamp = array('d')
+        self.venue = array('l')
+
+        # Quotes of each venue for edge e, at e * venues + venue
+        self.venue_weight = array('d')
+        self.venue_time = array('d')
+
+        self._allocate(max(capacity, 2))
+
+    def __len__(self):
+        """ The number of currencies in the graph """
+        return len(self.names)
+
+    def __contains__(self, name):
+        """ Is the given currency in the graph? """
+        return name in self.ids
+
+    @property
+    def vertex_count(self):
+        """
+        Returns the number of currencies interned in the graph.
+        """
+
+        return len(self.names)
+
+    def _allocate(self, capacity):
+        """
+        Resizes the edge arrays and rebuilds the edge index matrix for the
+        given number of currencies, keeping all existing edges.
+
+        Args:
+            capacity:
+                The new number of currencies to allocate space for
+        """
+
+        max_edges = capacity * (capacity - 1)   # No self loops
+        extra = max_edges - len(self.src)
+
+        # Extend the edge arrays, keeping the edges already in use
+        self.src.extend(array('l', [0]) * extra)
+        self.dst.extend(array('l', [0]) * extra)
+        self.weight.extend(array('d', [0.0]) * extra)
+        self.timestamp.extend(array('d', [0.0]) * extra)
+        self.venue.extend(array('l', [0]) * extra)
+        self.venue_weight.extend(array('d', [math.inf]) * (extra * self.venues))
+        self.venue_time.extend(array('d', [NO_QUOTE]) * (extra * self.venues))
+
+        # Rebuild the index matrix for the new row length
+        self.slot = array('l', [NO_EDGE]) * (capacity * capacity)
+        for e in range(self.edge_count):
+            self.slot[self.src[e] * capacity + self.dst[e]] = e
+
+        self.capacity = capacity
+
+    def intern(self, name) -> int:
+        """
+        Returns the id of a currency, adding it to the graph if needed.
+
+        Args:
+            name:
+                The three letter currency code
+
+        Returns:
+            The integer id of the currency
+        """
+
+        id = self.ids.get(name)
+
+        if id is None:
+            id = len(self.names)
+
+            # Double the capacity when out of room for currencies
+            if id == self.capacity:
+                self._allocate(self.capacity * 2)
+
+            self.ids[name] = id
+            self.names.append(name)
+
+        return id
+
+    def id_of(self, name):
+        """
+        Returns the id of a currency, or None if it is not in the graph.
+        """
+
+        return self.ids.get(name)
+
+    def name(self, id) -> str:
+        """
+        Returns the currency name for the given id.
+        """
+
+        return self.names[id]
+
+    def edge(self, u, v) -> int:
+        """
+        Returns the index of the edge from u to v, or NO_EDGE if none.
+        """
+
+        return self.slot[u * self.capacity + v]
+
+    def get_weight(self, u, v) -> float:
+        """
+        Returns the -log(price) weight of the edge from u to v.
+
+        Raises:
+            KeyError if there is no such edge
+        """
+
+        e = self.slot[u * self.capacity + v]
+        if e == NO_EDGE:
+            raise KeyError((u, v))
+
+        return self.weight[e]
+
+    def quote_time(self, u, v, venue=0) -> float:
+        """
+        Returns the time of the quote from a venue for the edge from u to v,
+        or NO_QUOTE if the venue has no quote for it.
+        """
+
+        e = self.slot[u * self.capacity + v]
+        if e == NO_EDGE:
+            return NO_QUOTE
+
+        return self.venue_time[e * self.venues + venue]
+
+    def _select_best(self, e):
+        """
+        Sets the weight, timestamp and venue of edge e from the venue with
+        the lowest weight, which is the best rate for that direction.
+
+        Returns:
+            False if no venue has a quote for the edge
+        """
+
+        base = e * self.venues
+        best = None
+
+        for venue in range(self.venues):
+            if self.venue_time[base + venue] != NO_QUOTE and (
+                    best is None or self.venue_weight[base + venue] < self.venue_weight[base + best]):
+                best = venue
+
+        if best is None:
+            return False
+
+        self.weight[e] = self.venue_weight[base + best]
+        self.timestamp[e] = self.venue_time[base + best]
+        self.venue[e] = best
+
+        return True
+
+    def upsert(self, u, v, weight, timestamp, venue=0) -> int:
+        """
+        Inserts or updates the quote of a venue for the edge from u to v, in
+        O(1) for a fixed number of venues.
+
+        Args:
+            u:
+                The id of the currency being sold
+            v:
+                The id of the currency being bought
+            weight:
+                The -log(price) of the exchange
+            timestamp:
+                The quote time in seconds since the epoch
+            venue:
+                The id of the venue that published the quote
+
+        Returns:
+            The index of the edge
+        """
+
+        index = u * self.capacity + v
+        e = self.slot[index]
+
+        # Append a new edge to the end of the dense edge list
+        if e == NO_EDGE:
+            e = self.edge_count
+            self.edge_count += 1
+            self.slot[index] = e
+            self.src[e] = u
+            self.dst[e] = v
+
+        self.venue_weight[e * self.venues + venue] = weight
+        self.venue_time[e * self.venues + venue] = timestamp
+
+        # A single venue is always the best one
+        if self.venues == 1:
+            self.weight[e] = weight
+            self.timestamp[e] = timestamp
+        else:
+            self._select_best(e)
+
+        return e
+
+    def add_quote(self, u, v, price, timestamp, venue=0):
+        """
+        Adds a quote of v per u as the edge u -> v with weight -log(price),
+        and its inverse as the edge v -> u.
+
+        Args:
+            u:
+                The id of the first currency in the cross
+            v:
+                The id of the second currency in the cross
+            price:
+                The number of v units exchanged per one unit of u
+            timestamp:
+                The quote time in seconds since the epoch
+            venue:
+                The id of the venue that published the quote
+        """
+
+        exchange = -math.log(price)
+        self.upsert(u, v, exchange, timestamp, venue)
+        self.upsert(v, u, -exchange, timestamp, venue)
+
+    def remove(self, u, v, venue=None) -> bool:
+        """
+        Removes the quote of a venue for the edge from u to v. The edge is
+        removed in O(1) once no venue quotes it, moving the last edge into
+        the freed slot.
+
+        Args:
+            u:
+                The id of the currency at the start of the edge
+            v:
+                The id of the currency at the end of the edge
+            venue:
+                The id of the venue, or None to remove the quotes of every
+                venue
+
+        Returns:
+            True if a quote was removed
+        """
+
+        index = u * self.capacity + v
+        e = self.slot[index]
+
+        if e == NO_EDGE:
+            return False
+
+        venues = self.venues
+        base = e * venues
+
+        if venue is not None:
+            if self.venue_time[base + venue] == NO_QUOTE:
+                return False
+
+            self.venue_weight[base + venue] = math.inf
+            self.venue_time[base + venue] = NO_QUOTE
+
+            # Keep the edge while another venue still quotes it
+            if venues > 1 and self._select_best(e):
+                return True
+
+        self.slot[index] = NO_EDGE
+        self.edge_count -= 1
+        last = self.edge_count
+
+        # Fill the hole with the last edge to keep the edge list dense
+        if e != last:
+            self.src[e] = self.src[last]
+            self.dst[e] = self.dst[last]
+            self.weight[e] = self.weight[last]
+            self.timestamp[e] = self.timestamp[last]
+            self.venue[e] = self.venue[last]
+            self.venue_weight[base:base + venues] = self.venue_weight[last * venues:(last + 1) * venues]
+            self.venue_time[base:base + venues] = self.venue_time[last * venues:(last + 1) * venues]
+            self.slot[self.src[e] * self.capacity + self.dst[e]] = e
+            base = last * venues
+
+        # Clear the venue quotes of the freed slot
+        for i in range(base, base + venues):
+            self.venue_weight[i] = math.inf
+            self.venue_time[i] = NO_QUOTE
+
+        return True
+
+class CrossSequencer(object):
+    """
+    CrossSequencer tracks the newest quote time seen for each cross, so that
+    a quote is only rejected as out of sequence by an older quote for the
+    same pair of currencies.
+
+    >>> sequencer = CrossSequencer()
+    >>> sequencer.accept('GBP/USD', 10.0), sequencer.accept('USD/JPY', 5.0)
+    (True, True)
+    >>> sequencer.accept('GBP/USD', 9.5), sequencer.accept('GBP/USD', 10.5)
+    (False, True)
+    """
+
+    def __init__(self) -> None:
+        """
+        The CrossSequencer constructor creates the cross ids and the table of
+        last seen quote times.
+        """
+
+        self.ids = {}                   # Cross name to pair id
+        self.last_seen = array('d')     # Newest quote time by pair id
+
+    def intern(self, cross) -> int:
+        """
+        Returns the pair id of a cross, adding it to the table if needed.
+
+        Args:
+            cross:
+                The cross name, such as 'GBP/USD'
+
+        Returns:
+            The integer pair id of the cross
+        """
+
+        id = self.ids.get(cross)
+
+        if id is None:
+            id = len(self.last_seen)
+            self.ids[cross] = id
+            self.last_seen.append(-math.inf)
+
+        return id
+
+    def accept(self, cross, timestamp) -> bool:
+        """
+        Checks a quote against the newest quote seen for its cross, and
+        records it if it is newer.
+
+        Args:
+            cross:
+                The cross name of the quote
+            timestamp:
+                The quote time in seconds since the epoch
+
+        Returns:
+            True if the quote is newer than every earlier quote for the cross
+        """
+
+        id = self.intern(cross)
+
+        if timestamp <= self.last_seen[id]:
+            return False
+
+        self.last_seen[id] = timestamp
+        return True
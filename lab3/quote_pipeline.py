@@ -0,0 +1,243 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: quote_pipeline.py
+
+A bounded ring buffer that connects the receiver stage of the subscriber to
+its compute stage. The receiver thread puts each datagram into the ring as
+soon as it arrives, and the compute thread drains everything pending before
+each detection run, so a slow Bellman-Ford pass no longer leaves datagrams
+to overflow the kernel buffer.
+
+The slots of the ring are a pool of preallocated bytearrays, each large
+enough for a full datagram, that the receiver fills in place with recv_into.
+The compute stage reads the slots it drained and then releases them back to
+the receiver, so no memory is allocated per datagram. Each slot also records
+the venue whose socket the datagram arrived on.
+
+When the ring is full the receiver either drops the datagram or waits for
+room, depending on the backpressure policy, and every drop is counted.
+
+>>> ring = RingBuffer(2, 4)
+>>> ring.put(b'a'), ring.put(b'bc', 1), ring.put(b'd')
+(True, True, False)
+>>> [(venue, bytes(view)) for venue, view in ring.drain(0)]
+[(0, b'a'), (1, b'bc')]
+>>> ring.release()
+>>> ring.dropped, ring.received
+(1, 3)
+"""
+
+import threading
+import time
+from array import array
+from fxp_bytes_subscriber import MAX_QUOTES_PER_MESSAGE, RECORD_LENGTH
+
+DATAGRAM_SIZE = MAX_QUOTES_PER_MESSAGE * RECORD_LENGTH  # Largest datagram
+DEFAULT_SLOTS = 256     # Number of datagrams the ring can hold
+DROP = 'drop'           # Backpressure policy: drop the newest datagram
+BLOCK = 'block'         # Backpressure policy: wait for room, then drop
+
+class RingBuffer(object):
+    """
+    RingBuffer is a fixed size, thread safe queue of datagrams held in a pool
+    of reusable buffers, with explicit backpressure and drop counters.
+
+    One receiver thread fills slots with acquire and commit, and one compute
+    thread reads them with drain and release.
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, size=DATAGRAM_SIZE, policy=DROP,
+                 block_timeout=0.05) -> None:
+        """
+        The RingBuffer constructor preallocates the buffer pool and the
+        counters.
+
+        Args:
+            slots:
+                The number of datagrams the ring can hold
+            size:
+                The number of bytes in each buffer
+            policy:
+                DROP to discard a datagram when the ring is full, or BLOCK to
+                wait up to block_timeout seconds for room first
+            block_timeout:
+                The longest time to wait for room under the BLOCK policy
+        """
+
+        if policy not in (DROP, BLOCK):
+            raise ValueError('Unknown backpressure policy {}'.format(policy))
+
+        self.slots = [bytearray(size) for _ in range(slots)]
+        self.views = [memoryview(slot) for slot in self.slots]
+        self.lengths = array('l', [0]) * slots
+        self.venues = array('l', [0]) * slots
+        self.times = array('d', [0.0]) * slots
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.head = 0       # Index of the oldest datagram
+        self.count = 0      # Number of slots holding datagrams
+        self.reading = 0    # Number of slots drained but not yet released
+        self.first_arrival = None   # Arrival time of the oldest drained datagram
+
+        # Counters
+        self.received = 0       # Datagrams offered to the ring
+        self.dropped = 0        # Datagrams discarded because the ring was full
+        self.blocked = 0        # Times the receiver had to wait for room
+        self.high_water = 0     # Most datagrams held at once
+
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self):
+        """ The number of datagrams waiting in the ring """
+        with self.lock:
+            return self.count - self.reading
+
+    def acquire(self):
+        """
+        Returns the index of the free slot at the tail of the ring for the
+        receiver to fill, applying backpressure if the ring is full.
+
+        Returns:
+            The slot index, or None if there is no room and the datagram
+            should be dropped
+        """
+
+        capacity = len(self.slots)
+
+        with self.lock:
+            # Apply backpressure when there is no room left
+            if self.count == capacity and self.policy == BLOCK:
+                self.blocked += 1
+                self.not_full.wait_for(lambda: self.count < capacity, self.block_timeout)
+
+            if self.count == capacity:
+                return None
+
+            return (self.head + self.count) % capacity
+
+    def commit(self, index, length, venue=0):
+        """
+        Queues the datagram the receiver wrote into an acquired slot.
+
+        Args:
+            index:
+                The slot index returned by acquire
+            length:
+                The number of bytes written into the slot
+            venue:
+                The id of the venue the datagram came from
+        """
+
+        self.lengths[index] = length
+        self.venues[index] = venue
+        self.times[index] = time.monotonic()
+
+        with self.lock:
+            self.received += 1
+            self.count += 1
+            self.high_water = max(self.high_water, self.count)
+
+            self.not_empty.notify()
+
+    def drop(self):
+        """
+        Counts a datagram that was discarded because the ring was full.
+        """
+
+        with self.lock:
+            self.received += 1
+            self.dropped += 1
+
+    def put(self, datagram, venue=0) -> bool:
+        """
+        Copies a datagram into the tail of the ring.
+
+        Args:
+            datagram:
+                The bytes received from the publisher
+            venue:
+                The id of the venue the datagram came from
+
+        Returns:
+            True if the datagram was queued, False if it was dropped
+        """
+
+        index = self.acquire()
+
+        if index is None:
+            self.drop()
+            return False
+
+        length = len(datagram)
+        self.slots[index][:length] = datagram
+        self.commit(index, length, venue)
+
+        return True
+
+    def drain(self, timeout=None) -> list:
+        """
+        Takes every datagram waiting in the ring, waiting for at least one
+        to arrive if the ring is empty. The slots stay reserved until
+        release is called, and first_arrival is set to the monotonic time
+        the oldest of them was committed.
+
+        Args:
+            timeout:
+                The longest time to wait for a datagram, or None to wait
+                forever
+
+        Returns:
+            The list of (venue, memoryview) pairs of the datagrams in the
+            order they were received, which is empty if the wait timed out
+        """
+
+        capacity = len(self.slots)
+
+        with self.lock:
+            if self.count == self.reading:
+                self.not_empty.wait_for(lambda: self.count > self.reading, timeout)
+
+            first, last = self.reading, self.count
+            self.reading = self.count
+
+        # Slots between reading and count are only touched by this thread
+        pending = []
+        self.first_arrival = self.times[(self.head + first) % capacity] if last > first else None
+
+        for i in range(first, last):
+            index = (self.head + i) % capacity
+            pending.append((self.venues[index], self.views[index][:self.lengths[index]]))
+
+        return pending
+
+    def release(self):
+        """
+        Returns the slots taken by the last drain to the receiver.
+        """
+
+        capacity = len(self.slots)
+
+        with self.lock:
+            self.head = (self.head + self.reading) % capacity
+            self.count -= self.reading
+            self.reading = 0
+
+            self.not_full.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Returns a snapshot of the ring counters.
+        """
+
+        with self.lock:
+            return {'received': self.received, 'dropped': self.dropped,
+                    'blocked': self.blocked, 'high_water': self.high_water,
+                    'pending': self.count - self.reading}
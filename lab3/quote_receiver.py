@@ -0,0 +1,158 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: quote_receiver.py
+
+The receive layer of the subscriber. A BatchReceiver waits for any of its
+UDP sockets to become readable, then drains every datagram that is ready in
+one wakeup by calling recv_into on the non-blocking socket until it would
+block. Each datagram is written straight into a free buffer of the RingBuffer
+pool, tagged with the venue of the socket it arrived on.
+
+There is one socket for each publisher subscribed to, so a datagram's venue
+is known from the socket without relying on the publisher's source port.
+
+Python does not expose recvmmsg, so the non-blocking loop stands in for it;
+the kernel receive buffer can also be enlarged with SO_RCVBUF to absorb
+bursts while the compute stage is busy.
+"""
+
+import selectors
+import socket
+import time
+from quote_pipeline import DATAGRAM_SIZE
+
+DEFAULT_RCVBUF = 1 << 20    # Requested kernel receive buffer in bytes
+
+class BatchReceiver(object):
+    """
+    BatchReceiver owns the subscriber's UDP sockets, one for each venue, and
+    moves ready datagrams into a RingBuffer.
+    """
+
+    def __init__(self, addresses, ring, rcvbuf=DEFAULT_RCVBUF, metrics=None) -> None:
+        """
+        The BatchReceiver constructor binds a non-blocking UDP socket for each
+        venue and registers them all with one selector.
+
+        Args:
+            addresses:
+                The list of host, port pairs to listen on, one for each venue
+                in venue id order. A port of 0 picks a free port.
+            ring:
+                The RingBuffer to fill with datagrams
+            rcvbuf:
+                The size in bytes to request for SO_RCVBUF, or None to keep
+                the system default
+            metrics:
+                The PipelineMetrics to record the time spent receiving in,
+                or None
+        """
+
+        self.ring = ring
+        self.metrics = metrics
+        self.scratch = bytearray(DATAGRAM_SIZE)     # Sink for dropped datagrams
+        self.selector = selectors.DefaultSelector()
+        self.socks = []
+
+        for venue, address in enumerate(addresses):
+            # Create a non-blocking listening socket using UDP
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if rcvbuf is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            sock.bind(address)
+            sock.setblocking(False)
+
+            self.selector.register(sock, selectors.EVENT_READ, venue)
+            self.socks.append(sock)
+
+    @property
+    def addresses(self) -> list:
+        """
+        Returns the bound host, port pairs of the sockets in venue id order.
+        """
+
+        return [sock.getsockname() for sock in self.socks]
+
+    @property
+    def rcvbuf(self) -> int:
+        """
+        Returns the kernel receive buffer size granted to the sockets.
+        """
+
+        return self.socks[0].getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def poll(self, timeout=None) -> list:
+        """
+        Waits for any socket to become readable, then drains every datagram
+        that is ready into the ring.
+
+        Args:
+            timeout:
+                The longest time to wait in seconds, or None to wait forever
+
+        Returns:
+            The list of ids of the venues that delivered datagrams in this
+            wakeup
+        """
+
+        venues = []
+        ready = self.selector.select(timeout)
+        start = time.perf_counter()
+
+        for key, _ in ready:
+            if self.drain(key.fileobj, key.data):
+                venues.append(key.data)
+
+        # Time the wakeup, not the wait for it
+        if venues and self.metrics is not None:
+            self.metrics.record('recv', time.perf_counter() - start)
+
+        return venues
+
+    def drain(self, sock, venue) -> int:
+        """
+        Receives from a socket until it would block.
+
+        Args:
+            sock:
+                The readable socket
+            venue:
+                The id of the venue the socket subscribes to
+
+        Returns:
+            The number of datagrams received
+        """
+
+        ring = self.ring
+        count = 0
+
+        while True:
+            # Receive into the next free buffer, or discard if the ring is full
+            index = ring.acquire()
+            buffer = ring.slots[index] if index is not None else self.scratch
+
+            try:
+                length = sock.recv_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                return count    # Nothing more is ready
+
+            if index is None:
+                ring.drop()
+            else:
+                ring.commit(index, length, venue)
+
+            count += 1
+
+    def close(self):
+        """
+        Closes the selector and the sockets.
+        """
+
+        self.selector.close()
+        for sock in self.socks:
+            sock.close()
@@ -0,0 +1,172 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 3: Pub/Sub
+Class: subscription_renewal.py
+
+Keeps the subscriptions of Lab3 alive. The publisher drops a subscriber once
+its subscription is older than the lease, so the RenewalScheduler sends the
+same subscription request again before the lease runs out, leaving no window
+without quotes. Renewal deadlines are kept in a min-heap so checking them
+costs nothing until one is due.
+
+Subscription requests travel over UDP and can be lost, and a publisher can
+restart and forget its subscribers. The scheduler therefore also watches
+when each venue last delivered a datagram. A venue that has been silent for
+longer than the gap threshold is resubscribed right away, and the length of
+every interruption is counted so blackouts show up in the stats.
+
+>>> renewals = RenewalScheduler(2, lease=20, lead=5, gap_threshold=3)
+>>> renewals.subscribed(0, 0.0); renewals.subscribed(1, 0.0)
+>>> renewals.received(0, 1.0); renewals.received(1, 1.0)
+>>> renewals.received(1, 3.0)
+>>> renewals.due(5.0)       # venue 0 has been silent for 4 seconds
+[0]
+>>> renewals.subscribed(0, 5.0)
+>>> renewals.received(0, 6.0)
+>>> renewals.stats()[0]['gaps'], renewals.stats()[0]['interrupted']
+(1, 5.0)
+>>> renewals.received(0, 14.0); renewals.received(1, 14.0)
+>>> renewals.due(15.0)      # venue 1 reaches its renewal time
+[1]
+"""
+
+import heapq
+
+LEASE = 19              # Seconds a subscription stays valid at the publisher
+LEAD = 5                # Seconds before the lease ends to renew
+GAP_THRESHOLD = 3.0     # Seconds of silence that count as an interruption
+RETRY_INTERVAL = 1.0    # Seconds between resubscribes to a silent venue
+
+class RenewalScheduler(object):
+    """
+    RenewalScheduler decides when each venue must be subscribed to again,
+    and measures how long each feed was interrupted.
+    """
+
+    def __init__(self, venues, lease=LEASE, lead=LEAD, gap_threshold=GAP_THRESHOLD,
+                 retry_interval=RETRY_INTERVAL) -> None:
+        """
+        The RenewalScheduler constructor sets the timing of renewals and the
+        per venue counters.
+
+        Args:
+            venues:
+                The number of venues subscribed to
+            lease:
+                The number of seconds a subscription stays valid
+            lead:
+                The number of seconds before the lease ends to renew. At most
+                half the lease is used as lead for short leases.
+            gap_threshold:
+                The number of seconds without a datagram that counts as an
+                interruption of the feed
+            retry_interval:
+                The shortest time between resubscribes to a silent venue
+        """
+
+        self.renew_after = max(lease - lead, lease / 2)
+        self.gap_threshold = gap_threshold
+        self.retry_interval = retry_interval
+
+        self.heap = []                          # Entries of (due, venue)
+        self.renew_at = [None] * venues         # Current renewal deadline
+        self.sent_at = [None] * venues          # Time of the last request
+        self.last_received = [None] * venues    # Time of the last datagram
+
+        # Counters
+        self.renewals = [0] * venues        # Subscription requests sent
+        self.resubscribes = [0] * venues    # Requests sent because of silence
+        self.gaps = [0] * venues            # Interruptions seen
+        self.interrupted = [0.0] * venues   # Total seconds interrupted
+        self.longest = [0.0] * venues       # Longest interruption
+
+    def subscribed(self, venue, now):
+        """
+        Records that a subscription request was sent, and schedules its
+        renewal.
+
+        Args:
+            venue:
+                The id of the venue
+            now:
+                The monotonic time the request was sent
+        """
+
+        self.renewals[venue] += 1
+        self.sent_at[venue] = now
+        self.renew_at[venue] = now + self.renew_after
+        heapq.heappush(self.heap, (self.renew_at[venue], venue))
+
+        # Measure silence from the first subscription
+        if self.last_received[venue] is None:
+            self.last_received[venue] = now
+
+    def received(self, venue, now):
+        """
+        Records that a venue delivered datagrams, counting the silence before
+        them as an interruption if it exceeded the gap threshold.
+
+        Args:
+            venue:
+                The id of the venue
+            now:
+                The monotonic time the datagrams were received
+        """
+
+        last = self.last_received[venue]
+
+        if last is not None and now - last > self.gap_threshold:
+            gap = now - last
+            self.gaps[venue] += 1
+            self.interrupted[venue] += gap
+            self.longest[venue] = max(self.longest[venue], gap)
+
+        self.last_received[venue] = now
+
+    def due(self, now) -> list:
+        """
+        Returns the venues to subscribe to again: those whose renewal deadline
+        has passed, and those that have been silent past the gap threshold.
+
+        Args:
+            now:
+                The current monotonic time
+
+        Returns:
+            The list of venue ids, each at most once
+        """
+
+        heap = self.heap
+        venues = set()
+
+        # Pop renewal deadlines that have passed
+        while heap and heap[0][0] <= now:
+            renew_at, venue = heapq.heappop(heap)
+
+            # Skip deadlines replaced by a later subscription
+            if renew_at == self.renew_at[venue]:
+                venues.add(venue)
+
+        # Resubscribe to silent venues, at most once per retry interval
+        for venue, last in enumerate(self.last_received):
+            if last is not None and now - last > self.gap_threshold and \
+                    now - self.sent_at[venue] >= self.retry_interval:
+                if venue not in venues:
+                    self.resubscribes[venue] += 1
+                venues.add(venue)
+
+        return sorted(venues)
+
+    def stats(self) -> list:
+        """
+        Returns the renewal and interruption counters of each venue.
+        """
+
+        return [{'renewals': self.renewals[venue], 'resubscribes': self.resubscribes[venue],
+                 'gaps': self.gaps[venue], 'interrupted': self.interrupted[venue],
+                 'longest': self.longest[venue]}
+                for venue in range(len(self.renewals))]
@@ -0,0 +1,177 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 4: DHT
+Class: bench_modrange.py
+
+Microbenchmark of ring interval tests with 160-bit SHA-1 ids, comparing
+x in ModRange(a, b, NODES) with the allocation-free between(a, x, b). Both
+are first checked to agree on random and edge case intervals, then timed on
+a single membership test and on whole lookups: find_predecessor run locally
+over a simulated ring of nodes with complete finger tables, making the same
+interval tests as ChordNode without the RPCs.
+
+Usage:
+    python3 bench_modrange.py [--samples N] [--nodes N] [--seed S]
+"""
+
+import argparse
+import bisect
+import random
+import timeit
+
+from chord_node import M, NODES, ModRange, between
+
+DEFAULT_SAMPLES = 2000  # Random intervals to check and time
+DEFAULT_NODES = 1000    # Nodes on the simulated ring
+DEFAULT_SEED = 5520     # Seed of the random ids
+
+def random_ids(rng, count) -> list:
+    """
+    Returns a list of random ids on the ring.
+    """
+
+    return [rng.randrange(NODES) for _ in range(count)]
+
+def check(rng, samples):
+    """
+    Checks that between and ModRange agree, including wraparound, empty and
+    full ring intervals.
+
+    Args:
+        rng:
+            The random generator
+        samples:
+            The number of random intervals to check
+    """
+
+    cases = [(0, 0, 0), (5, 5, 5), (NODES - 1, 0, 0), (NODES - 1, NODES - 1, 1)]
+    for _ in range(samples):
+        a, x, b = random_ids(rng, 3)
+        cases += [(a, x, b), (a, a, b), (a, b, b), (b, x, a), (a, x, a)]
+
+    for a, x, b in cases:
+        if between(a, x, b) != (x in ModRange(a, b, NODES)):
+            raise AssertionError('between({}, {}, {}) disagrees with ModRange'.format(a, x, b))
+
+def build_ring(rng, count) -> dict:
+    """
+    Builds the finger tables of a ring of random node ids.
+
+    Args:
+        rng:
+            The random generator
+        count:
+            The number of nodes
+
+    Return:
+        The dictionary of finger lists by node id, index 0 unused
+    """
+
+    nodes = sorted(random_ids(rng, count))
+
+    def successor(id):
+        return nodes[bisect.bisect_left(nodes, id) % len(nodes)]
+
+    return {node: [None] + [successor((node + 2 ** (k - 1)) % NODES) for k in range(1, M + 1)]
+            for node in nodes}
+
+def lookup(test, ring, node, id) -> tuple:
+    """
+    Finds the predecessor of an id the way ChordNode.find_predecessor does,
+    using the given interval test.
+
+    Args:
+        test:
+            A function taking (a, x, b) and returning whether x is in [a, b)
+        ring:
+            The finger tables from build_ring
+        node:
+            The node the lookup starts at
+        id:
+            The id being looked up
+
+    Return:
+        The predecessor node and the number of interval tests made
+    """
+
+    tests = 0
+    n_prime = node
+
+    while True:
+        fingers = ring[n_prime]
+        tests += 1
+        if test(n_prime + 1, id, fingers[1] + 1):
+            return n_prime, tests
+
+        # closest_preceding_finger, scanning from the farthest finger
+        for i in range(M, 0, -1):
+            tests += 1
+            if test(n_prime + 1, fingers[i], id):
+                n_prime = fingers[i]
+                break
+
+def run(samples=DEFAULT_SAMPLES, nodes=DEFAULT_NODES, seed=DEFAULT_SEED) -> dict:
+    """
+    Times both interval tests.
+
+    Return:
+        The timings in nanoseconds per test and microseconds per lookup, and
+        the average number of tests per lookup
+    """
+
+    rng = random.Random(seed)
+    check(rng, samples)
+
+    intervals = [tuple(random_ids(rng, 3)) for _ in range(samples)]
+    modrange = lambda a, x, b: x in ModRange(a, b, NODES)
+
+    # Lookups of random ids from random nodes, which must agree
+    ring = build_ring(rng, nodes)
+    starts = list(ring)
+    lookups = [(rng.choice(starts), rng.randrange(NODES)) for _ in range(samples // 10 or 1)]
+    tests = 0
+    for node, id in lookups:
+        found, count = lookup(between, ring, node, id)
+        if found != lookup(modrange, ring, node, id)[0]:
+            raise AssertionError('lookups of {} disagree'.format(id))
+        tests += count
+
+    def time_tests(test):
+        def loop():
+            for a, x, b in intervals:
+                test(a, x, b)
+        return min(timeit.repeat(loop, number=1, repeat=5)) / len(intervals) * 1e9
+
+    def time_lookups(test):
+        def loop():
+            for node, id in lookups:
+                lookup(test, ring, node, id)
+        return min(timeit.repeat(loop, number=1, repeat=5)) / len(lookups) * 1e6
+
+    return {'modrange_ns': time_tests(modrange), 'between_ns': time_tests(between),
+            'modrange_lookup_us': time_lookups(modrange), 'between_lookup_us': time_lookups(between),
+            'tests_per_lookup': tests / len(lookups)}
+
+
+# Main Function
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark ring interval tests')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    results = run(args.samples, args.nodes, args.seed)
+
+    print('{}-bit ids, results agree on {} random intervals'.format(M, args.samples))
+    print('membership test:  ModRange {:8.0f} ns   between {:8.0f} ns   {:5.1f}x'.format(
+        results['modrange_ns'], results['between_ns'],
+        results['modrange_ns'] / results['between_ns']))
+    print('lookup ({} nodes, {:.0f} tests): ModRange {:.1f} us   between {:.1f} us   saves {:.1f} us'.format(
+        args.nodes, results['tests_per_lookup'], results['modrange_lookup_us'],
+        results['between_lookup_us'], results['modrange_lookup_us'] - results['between_lookup_us']))
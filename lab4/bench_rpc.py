@@ -0,0 +1,174 @@
+"""
+CPSC 5520, Seattle University
+This is free and unencumbered software released into the public domain.
+:Authors: Bobby Brown rbrown3
+:Version: 1.0
+
+Lab 4: DHT
+Class: bench_rpc.py
+
+Benchmark of RPCs per second served by one ChordNode, comparing a thread per
+request with the bounded worker pool. The node runs alone in a subprocess
+with its output discarded. At each concurrency level, that many connections
+are opened, and PIPELINE client threads share each connection, each keeping
+one lookup_step RPC outstanding, so the RPCs outstanding at the top level
+exceed the queue depth and the rejection path is exercised. RPCs rejected as
+Overloaded are counted separately.
+
+Usage:
+    python3 bench_rpc.py [--port PORT] [--duration SECONDS]
+                         [--concurrency N [N ...]] [--pipeline N]
+                         [--workers N] [--queue-depth N]
+"""
+
+import argparse
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from chord_node import (DEFAULT_HOST, NODES, PORT_START, QUEUE_DEPTH, WORKERS,
+                        Overloaded, RpcConnection)
+
+DURATION = 3.0                      # Seconds each level is timed for
+CONCURRENCY = [1, 4, 16, 64, 256]   # Connections of each level
+PIPELINE = 4                        # RPCs outstanding on each connection
+START_TIMEOUT = 10.0                # Seconds to wait for the node to listen
+
+# Started in the subprocess, with the port, workers and queue depth. The main
+# thread must stay alive, as the worker pool refuses work once it exits
+NODE_SCRIPT = '''
+import sys
+import threading
+from chord_node import ChordNode
+node = ChordNode(int(sys.argv[1]), None, 1, int(sys.argv[2]), int(sys.argv[3]))
+node.join()
+threading.Event().wait()
+'''
+
+def start_node(port, workers, queue_depth) -> subprocess.Popen:
+    """
+    Starts a single node network in a subprocess and waits until it listens.
+
+    Args:
+        port:
+            The port of the node
+        workers:
+            The number of worker threads, 0 for a thread per request
+        queue_depth:
+            The number of RPCs queued before rejecting
+
+    Return:
+        The node's process
+    """
+
+    process = subprocess.Popen([sys.executable, '-c', NODE_SCRIPT, str(port),
+                                str(workers), str(queue_depth)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + START_TIMEOUT
+
+    while True:
+        try:
+            socket.create_connection((DEFAULT_HOST, port)).close()
+            return process
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError('node on port {} did not start'.format(port))
+            time.sleep(0.05)
+
+def measure(address, concurrency, duration, pipeline=PIPELINE) -> tuple:
+    """
+    Runs client threads against a node for the given duration.
+
+    Args:
+        address:
+            The host, port tuple address of the node
+        concurrency:
+            The number of connections
+        duration:
+            The number of seconds to run for
+        pipeline:
+            The number of client threads sharing each connection
+
+    Return:
+        The RPCs per second completed and the number rejected
+    """
+
+    connections = [RpcConnection(address) for _ in range(concurrency)]
+    clients = concurrency * pipeline
+    counts = [[0, 0] for _ in range(clients)]   # Completed and rejected
+    stop = threading.Event()
+
+    def client(connection, count):
+        rng = random.Random()
+        while not stop.is_set():
+            try:
+                connection.call('lookup_step', rng.randrange(NODES))
+                count[0] += 1
+            except Overloaded:
+                count[1] += 1
+
+    threads = [threading.Thread(target=client, args=(connections[i % concurrency], counts[i]))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for connection in connections:
+        connection.close()
+
+    return sum(c[0] for c in counts) / elapsed, sum(c[1] for c in counts)
+
+def run(port=PORT_START, duration=DURATION, levels=CONCURRENCY, workers=WORKERS,
+        queue_depth=QUEUE_DEPTH, pipeline=PIPELINE) -> dict:
+    """
+    Times both serving modes at every concurrency level.
+
+    Return:
+        The dictionary of (RPCs per second, rejected) lists by mode
+    """
+
+    results = {}
+
+    for mode, count in (('thread', 0), ('pool', workers)):
+        process = start_node(port, count, queue_depth)
+        try:
+            results[mode] = [measure((DEFAULT_HOST, port), level, duration, pipeline)
+                             for level in levels]
+        finally:
+            process.kill()
+            process.wait()
+
+    return results
+
+
+# Main Function
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark ChordNode RPC serving')
+    parser.add_argument('--port', type=int, default=PORT_START)
+    parser.add_argument('--duration', type=float, default=DURATION)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY)
+    parser.add_argument('--pipeline', type=int, default=PIPELINE)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH)
+    args = parser.parse_args()
+
+    results = run(args.port, args.duration, args.concurrency, args.workers, args.queue_depth,
+                  args.pipeline)
+
+    print('{:>11}  {:>11}  {:>22}  {:>22}'.format('concurrency', 'outstanding',
+                                                  'thread per request',
+                                                  'pool of {}'.format(args.workers)))
+    for i, level in enumerate(args.concurrency):
+        cells = ['{:9.0f} rpc/s {:6d} rej'.format(*results[mode][i]) for mode in ('thread', 'pool')]
+        print('{:>11}  {:>11}  {:>22}  {:>22}'.format(level, level * args.pipeline, *cells))
@@ -14,11 +14,21 @@ incoming connections (other nodes or queriers). You can use blocking TCP for
 this and pickle for the marshaling.
 """
 
+import bisect
+import builtins
 import hashlib
+import itertools
+import os
 import pickle
+import random
+import signal
 import socket
+import struct
 import sys
 import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
 
@@ -29,6 +39,55 @@ BUFFER_SIZE = 8192  # socket recv arg
 BACKLOG = 100  # socket listen arg
 PORT_START = 47500  # Starting port number on localhost
 PORT_END = 64999    # Maximum port number
+CACHE_SIZE = 1024   # Addresses outside the port range kept by a NodeDirectory
+FRAME_HEADER = struct.Struct('>I')  # Length prefix of each RPC frame
+RPC_TIMEOUT = 30.0  # Seconds to wait for an RPC reply
+CONNECT_TIMEOUT = 5.0   # Seconds to wait for a connection to a node
+ALPHA = 1           # Lookup probes in flight, 1 for the serial lookup
+PROBE_TIMEOUT = 0.5 # Seconds before a slow probe stops holding a lookup slot
+WORKERS = 32        # Threads serving RPCs, 0 for a thread per request
+NESTED_RPCS = {'get_value', 'put_value', 'find_successor', 'notify', 'update_finger_table'}
+                    # RPCs that make RPCs of their own, served off the workers
+QUEUE_DEPTH = 256   # RPCs queued or running before new ones are rejected
+STABILIZE = True    # Join with one lookup and converge by periodic stabilization
+STABILIZE_INTERVAL = 1.0    # Seconds between rounds of stabilization
+SUCCESSORS = 3      # Length of the successor list, and replicas of each key
+REPAIR_ROUNDS = 5   # Rounds of stabilization between replica repairs
+FALLBACKS = 3       # Preceding fingers a lookup hop can try, closest first
+MIGRATE_BATCH = 256 # Keys moved by each RPC of a join or leave
+
+def between(a, x, b, mod=NODES) -> bool:
+    """
+    Tests whether x is in the interval [a, b) of a ring of mod ids, without
+    building any range objects. The interval wraps around 0 when b is before
+    a, and is the whole ring when a and b are equal, just like
+    x in ModRange(a, b, mod). Open or closed ends are made by shifting a
+    bound by one, for example (a, b] is between(a + 1, x, b + 1).
+
+    >>> between(1, 1, 4, 100), between(1, 3, 4, 100), between(1, 4, 4, 100)
+    (True, True, False)
+    >>> between(97, 99, 2, 100), between(97, 0, 2, 100), between(97, 2, 2, 100)
+    (True, True, False)
+    >>> between(5, 3, 5, 100)
+    True
+
+    Args:
+        a:
+            The first id in the interval
+        x:
+            The id to test
+        b:
+            The id just past the end of the interval
+        mod:
+            The number of ids in the ring
+
+    Return:
+        True if x is in the interval
+    """
+
+    # Distances clockwise from a, with a full circle when a and b are equal
+    span = (b - a) % mod
+    return span == 0 or (x - a) % mod < span
 
 class ModRange(object):
     """
@@ -74,7 +133,7 @@ class ModRange(object):
 
     def __repr__(self):
         """ Something like the interval|node charts in the paper """
-        return ''.format(self.start, self.stop, self.divisor)
+        return '<mrange [{},{})%{}>'.format(self.start, self.stop, self.divisor)
 
     def __contains__(self, id):
         """ Is the given id within this finger's interval? """
@@ -118,42 +177,749 @@ class ModRangeIter(object):
 
 class FingerEntry(object):
     """
-    Row in a finger table.
+    Row in a finger table. The interval is computed when asked for, so an
+    entry only holds its bounds and node.
 
     >>> fe = FingerEntry(0, 1)
     >>> fe
-    
+    [1, 2) | None
     >>> fe.node = 1
     >>> fe
-    
+    [1, 2) | 1
     >>> 1 in fe, 2 in fe
     (True, False)
-    >>> FingerEntry(0, 2, 3), FingerEntry(0, 3, 0)
-    (, )
-    >>> FingerEntry(3, 1, 0), FingerEntry(3, 2, 0), FingerEntry(3, 3, 0)
-    (, , )
-    >>> fe = FingerEntry(3, 3, 0)
-    >>> 7 in fe and 0 in fe and 2 in fe and 3 not in fe
+    >>> fe.interval
+    <mrange [1,2)%1461501637330902918203684832716283019655932542976>
+    >>> fe = FingerEntry(3, M, 0)
+    >>> 0 in fe and 2 in fe and 3 not in fe and 7 not in fe
     True
 
-    This code was given as part of Lab 4.
-    """
+    This code was given as part of Lab 4.
+    """
+
+    __slots__ = ('start', 'next_start', 'node')
+
+    def __init__(self, n, k, node=None):
+        if not (0 <= n < NODES and 0 < k <= M):
+            raise ValueError('invalid finger entry values')
+        self.start = (n + 2**(k-1)) % NODES
+        self.next_start = (n + 2**k) % NODES if k < M else n
+        self.node = node
+
+    @property
+    def interval(self):
+        """ The finger's interval as a ModRange """
+        return ModRange(self.start, self.next_start, NODES)
+
+    def __repr__(self):
+        """ Something like the interval|node charts in the paper """
+        return '[{}, {}) | {}'.format(self.start, self.next_start, self.node)
+
+    def __contains__(self, id):
+        """ Is the given id within this finger's interval? """
+        return between(self.start, id, self.next_start)
+
+class FingerTable(object):
+    """
+    FingerTable is the finger table of one node, kept as parallel lists of
+    finger starts and finger nodes indexed 1 to M like the paper, instead of
+    M FingerEntry objects. Intervals are computed on demand.
+
+    >>> table = FingerTable(0)
+    >>> table.start[1], table.start[3], table.interval(M) == (2 ** (M - 1), 0)
+    (1, 4, True)
+    >>> table.node[1:] = [8] * 3 + [16] * (M - 3)
+    >>> table.closest_preceding(12), table.closest_preceding(20), table.closest_preceding(5)
+    (8, 16, 0)
+    >>> table.preceding(20, 3), table.preceding(12, 3), table.preceding(5, 3)
+    ([16, 8], [8], [0])
+    >>> table[4]
+    [8, 16) | 16
+    """
+
+    __slots__ = ('n', 'start', 'node')
+
+    def __init__(self, n) -> None:
+        """
+        The FingerTable constructor computes the finger starts of a node.
+
+        Args:
+            n:
+                The id of the node owning the table
+        """
+
+        self.n = n
+        self.start = [None] + [(n + 2 ** (k - 1)) % NODES for k in range(1, M + 1)]
+        self.node = [None] * (M + 1)
+
+    def interval(self, k) -> tuple:
+        """
+        Returns the bounds of the k-th finger's interval [start, next start).
+
+        Args:
+            k:
+                The finger index, from 1 to M
+        """
+
+        return self.start[k], self.start[k + 1] if k < M else self.n
+
+    def __getitem__(self, k) -> FingerEntry:
+        """
+        Returns the k-th row as a FingerEntry, for display.
+        """
+
+        return FingerEntry(self.n, k, self.node[k])
+
+    def closest_preceding(self, id) -> int:
+        """
+        Returns the farthest finger node in (n, id), or n if there is none.
+
+        The scan runs from the last finger back with the test of between
+        inlined against a distance computed once for the whole scan.
+
+        Args:
+            id:
+                The id being looked up
+
+        Return:
+            The closest preceding node
+        """
+
+        n = self.n
+        node = self.node
+        span = (id - n - 1) % NODES
+
+        # An empty span is the whole ring, so the last finger precedes id
+        if span == 0:
+            return node[M]
+
+        for i in range(M, 0, -1):
+            if (node[i] - n - 1) % NODES < span:
+                return node[i]
+
+        return n
+
+    def preceding(self, id, count) -> list:
+        """
+        Returns up to count distinct finger nodes in (n, id), closest to id
+        first, or [n] if there are none.
+
+        Args:
+            id:
+                The id being looked up
+            count:
+                The number of nodes wanted
+
+        Return:
+            The list of preceding nodes
+        """
+
+        n = self.n
+        span = (id - n - 1) % NODES or NODES
+        found = []
+
+        for i in range(M, 0, -1):
+            finger = self.node[i]
+            if (finger - n - 1) % NODES < span and finger not in found:
+                found.append(finger)
+                if len(found) == count:
+                    break
+
+        return found or [n]
+
+class KeyStore(object):
+    """
+    KeyStore holds a node's values by id, in a dictionary for get and put and
+    a sorted list of the ids for range queries. Intervals are [start, stop)
+    clockwise around the ring like ModRange, wrapping past 0 when start is
+    after stop, and the whole ring when they are equal. Finding the ends of
+    an interval takes two bisections, so counting its ids is O(log n).
+
+    >>> store = KeyStore()
+    >>> for id in (40, 10, 30, 20, NODES - 5):
+    ...     store[id] = str(id)
+    >>> list(store), store[30], 25 in store, len(store)
+    ([10, 20, 30, 40, 1461501637330902918203684832716283019655932542971], '30', False, 5)
+    >>> store.range(15, 35), store.count(15, 35), store.count(35, 15)
+    ([20, 30], 2, 3)
+    >>> store.range(NODES - 10, 25), store.range(30, 30, limit=3)
+    ([1461501637330902918203684832716283019655932542971, 10, 20], [30, 40, 1461501637330902918203684832716283019655932542971])
+    >>> store.items(10, 21)
+    [(10, '10'), (20, '20')]
+    >>> store.pop(20), store.range(0, 35)
+    ('20', [10, 30])
+    """
+
+    def __init__(self) -> None:
+        self.values = {}        # Values by id
+        self.ids = []           # Sorted ids of the values
+        self.lock = threading.Lock()
+
+    def __getitem__(self, id):
+        return self.values[id]
+
+    def __setitem__(self, id, data):
+        """
+        Stores a value, inserting a new id into the sorted ids.
+        """
+
+        with self.lock:
+            if id not in self.values:
+                bisect.insort(self.ids, id)
+            self.values[id] = data
+
+    def __contains__(self, id) -> bool:
+        return id in self.values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self):
+        """ Iterates over the ids in order """
+        return iter(list(self.ids))
+
+    def get(self, id, default=None):
+        return self.values.get(id, default)
+
+    def update(self, values):
+        """
+        Stores every value of a dictionary by id.
+        """
+
+        for id, data in values.items():
+            self[id] = data
+
+    def pop(self, id, default=None):
+        """
+        Removes an id, returning its value or the default if it is not held.
+        """
+
+        with self.lock:
+            if id not in self.values:
+                return default
+            del self.ids[bisect.bisect_left(self.ids, id)]
+            return self.values.pop(id)
+
+    def bounds(self, start, stop) -> tuple:
+        """
+        Returns the slices of the sorted ids that make up [start, stop).
+
+        Return:
+            One (first, last) pair of list indexes, or two when the interval
+            wraps past 0
+        """
+
+        ids = self.ids
+        start, stop = start % NODES, stop % NODES
+        i = bisect.bisect_left(ids, start)
+        j = bisect.bisect_left(ids, stop)
+
+        if start < stop:
+            return ((i, j),)
+
+        # The tail of the list, then the head up to stop
+        return (i, len(ids)), (0, j)
+
+    def range(self, start, stop, limit=None) -> list:
+        """
+        Returns the ids in [start, stop) in ring order from start.
+
+        Args:
+            start:
+                The first id of the interval
+            stop:
+                The id after the interval
+            limit:
+                The most ids to return, or None for all of them
+        """
+
+        with self.lock:
+            found = []
+            for i, j in self.bounds(start, stop):
+                if limit is not None:
+                    j = min(j, i + limit - len(found))
+                found += self.ids[i:j]
+            return found
+
+    def items(self, start, stop, limit=None) -> list:
+        """
+        Returns the id, value pairs in [start, stop) in ring order from start.
+        """
+
+        return [(id, self.values[id]) for id in self.range(start, stop, limit)
+                if id in self.values]
+
+    def count(self, start, stop) -> int:
+        """
+        Returns the number of ids in [start, stop).
+        """
+
+        with self.lock:
+            return sum(j - i for i, j in self.bounds(start, stop))
+
+class NodeDirectory(object):
+    """
+    NodeDirectory resolves node ids to the addresses of their servers. The
+    ids of every port in the configured range on the default host are hashed
+    once when the directory is created, and addresses outside that range are
+    learned from the hints carried by RPC replies and kept in a bounded least
+    recently used cache.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, ports=range(PORT_START, PORT_END + 1),
+                 capacity=CACHE_SIZE) -> None:
+        """
+        The NodeDirectory constructor precomputes the index of the port range.
+
+        Args:
+            host:
+                The host the nodes of the port range run on
+            ports:
+                The range of ports nodes may listen on
+            capacity:
+                The number of learned addresses to keep
+        """
+
+        self.index = {Chord.lookup_node((host, port)): (host, port) for port in ports}
+        self.cache = OrderedDict()
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+    def lookup(self, node):
+        """
+        Returns the address of a node.
+
+        Args:
+            node:
+                The id of the node
+
+        Return:
+            The host, port tuple address, or None if it is not known
+        """
+
+        address = self.index.get(node)
+        if address is not None:
+            return address
+
+        with self.lock:
+            address = self.cache.get(node)
+            if address is not None:
+                self.cache.move_to_end(node)
+            return address
+
+    def learn(self, node, address):
+        """
+        Remembers the address of a node that is not in the index.
+
+        Args:
+            node:
+                The id of the node
+            address:
+                The host, port tuple address of the node
+        """
+
+        if self.index.get(node) == address:
+            return
+
+        with self.lock:
+            self.cache[node] = tuple(address)
+            self.cache.move_to_end(node)
+
+            # Forget the least recently used address
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    def learn_all(self, hints):
+        """
+        Remembers every address of a dictionary of hints.
+
+        Args:
+            hints:
+                The dictionary of addresses by node id
+        """
+
+        for node, address in hints.items():
+            self.learn(node, address)
+
+    def hints(self, *nodes) -> dict:
+        """
+        Returns the known addresses of the given node ids, to send along with
+        an RPC reply. Tuples and lists, like the successor list and fingers of
+        a lookup_step, are searched for ids, and other values are skipped.
+
+        Args:
+            nodes:
+                The node ids, or other values of a reply
+
+        Return:
+            The dictionary of addresses by node id
+        """
+
+        hints = {}
+
+        for node in nodes:
+            if type(node) in (tuple, list):
+                hints.update(self.hints(*node))
+
+            # Only ids outside the index need to be told
+            elif type(node) is int and node not in self.index:
+                address = self.lookup(node)
+                if address is not None:
+                    hints[node] = address
+
+        return hints
+
+def digest(value) -> bytes:
+    """
+    Returns a digest of a value, for comparing replicas without sending
+    the values themselves.
+
+    Args:
+        value:
+            The value of a key
+
+    Return:
+        The SHA-1 digest of the pickled value
+    """
+
+    return hashlib.sha1(pickle.dumps(value)).digest()
+
+def send_frame(sock, message):
+    """
+    Sends a pickled message on a TCP socket, prefixed with its length.
+
+    Args:
+        sock:
+            The connected TCP socket
+        message:
+            The object to send
+    """
+
+    data = pickle.dumps(message)
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def recv_frame(sock):
+    """
+    Receives one length prefixed pickled message from a TCP socket.
+
+    Args:
+        sock:
+            The connected TCP socket
+
+    Return:
+        The object received, or None if the connection was closed
+    """
+
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+
+    data = recv_exactly(sock, FRAME_HEADER.unpack(header)[0])
+    if data is None:
+        raise ConnectionError('connection closed inside a frame')
+
+    return pickle.loads(data)
+
+def recv_exactly(sock, size):
+    """
+    Receives exactly size bytes from a TCP socket.
+
+    Return:
+        The bytes, or None if the connection was closed before any arrived
+    """
+
+    buffer = bytearray()
+
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), BUFFER_SIZE))
+        if not chunk:
+            if not buffer:
+                return None
+            raise ConnectionError('connection closed after {} of {} bytes'.format(
+                len(buffer), size))
+        buffer += chunk
+
+    return bytes(buffer)
+
+class Overloaded(RuntimeError):
+    """
+    Overloaded is the error returned for a RPC rejected because the queue of
+    the node's workers is full.
+    """
+
+class NotSent(ConnectionError):
+    """
+    NotSent is the error of a RPC whose request never reached the node, so
+    it is safe to make again.
+    """
+
+def encode_error(error) -> tuple:
+    """
+    Returns the failure of a RPC in a form any caller can unpickle, whatever
+    module the error's class was defined in.
+
+    Args:
+        error:
+            The exception raised by the RPC method
+
+    Return:
+        The name of the exception class and its message
+    """
+
+    return type(error).__name__, str(error)
+
+def decode_error(failure) -> Exception:
+    """
+    Returns the exception to raise at the caller for the failure of a RPC.
+    Overloaded and the built-in exceptions keep their class, and any other
+    becomes a RuntimeError naming it.
+
+    Args:
+        failure:
+            The name of the exception class and its message
+
+    Return:
+        The exception
+    """
+
+    name, message = failure
+    kind = Overloaded if name == 'Overloaded' else getattr(builtins, name, None)
+
+    if not (isinstance(kind, type) and issubclass(kind, Exception)):
+        return RuntimeError('{}: {}'.format(name, message))
+
+    return kind(message)
+
+class PendingCall(object):
+    """
+    PendingCall holds the reply of one outstanding RPC until it arrives.
+    """
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=RPC_TIMEOUT):
+        """
+        Waits for the reply and returns its result.
+
+        Args:
+            timeout:
+                The number of seconds to wait
+
+        Return:
+            The result of the RPC, raising the error of a failed one
+        """
+
+        if not self.event.wait(timeout):
+            raise TimeoutError('no reply within {} seconds'.format(timeout))
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+class RpcConnection(object):
+    """
+    RpcConnection is one persistent TCP connection to a node, shared by every
+    thread that calls it. Each request carries an id so the replies, which may
+    come back in any order, are matched to their callers by a reader thread.
+    """
+
+    def __init__(self, address, timeout=CONNECT_TIMEOUT) -> None:
+        """
+        The RpcConnection constructor connects to the node and starts the
+        reader thread.
+
+        Args:
+            address:
+                The host, port tuple address of the node
+            timeout:
+                The number of seconds to wait for the connection
+        """
+
+        self.address = address
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.settimeout(None)  # Replies are waited on by the reader thread
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending = {}   # PendingCalls by request id
+        self.ids = itertools.count()
+        self.closed = False
+
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def call(self, method, arg1=None, arg2=None, timeout=RPC_TIMEOUT):
+        """
+        Sends a request and waits for its reply.
+
+        Args:
+            method:
+                The remote method to invoke
+            arg1:
+                The first argument
+            arg2:
+                The second argument
+            timeout:
+                The number of seconds to wait for the reply
+
+        Return:
+            The result and the address hints of the reply
+
+        Raises:
+            NotSent if the request could not be sent, or ConnectionError if
+            the connection failed after sending it
+        """
+
+        pending = PendingCall()
+
+        with self.lock:
+            if self.closed:
+                raise NotSent('connection to {} is closed'.format(self.address))
+            request_id = next(self.ids)
+            self.pending[request_id] = pending
+
+        try:
+            try:
+                with self.send_lock:
+                    send_frame(self.sock, (request_id, method, arg1, arg2))
+            except OSError as e:
+                self.close(ConnectionError('send to {} failed: {}'.format(self.address, e)))
+                raise NotSent('send to {} failed: {}'.format(self.address, e))
+
+            return pending.wait(timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def read_replies(self):
+        """
+        Hands each reply to the call waiting for it, until the connection
+        closes.
+        """
+
+        error = ConnectionError('connection to {} was closed'.format(self.address))
+
+        try:
+            while True:
+                reply = recv_frame(self.sock)
+                if reply is None:
+                    break
+
+                request_id, result, hints, failure = reply
+                with self.lock:
+                    pending = self.pending.get(request_id)
+
+                if pending is not None:
+                    pending.result = (result, hints)
+                    pending.error = decode_error(failure) if failure is not None else None
+                    pending.event.set()
+        except Exception as e:
+            # Any reply that cannot be read leaves the stream unusable
+            error = ConnectionError('connection to {} failed: {}'.format(self.address, e))
+
+        self.close(error)
+
+    def close(self, error=None):
+        """
+        Closes the connection and fails every call still waiting on it.
+
+        Args:
+            error:
+                The exception given to the waiting calls
+        """
+
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self.pending = self.pending, {}
+
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+        for call in pending.values():
+            call.error = error or ConnectionError('connection to {} closed'.format(self.address))
+            call.event.set()
+
+class ConnectionPool(object):
+    """
+    ConnectionPool keeps one RpcConnection per node address, opening it on the
+    first call and replacing it once it has closed.
+    """
+
+    def __init__(self) -> None:
+        self.connections = {}   # RpcConnections by address
+        self.lock = threading.Lock()
+
+    def get(self, address) -> tuple:
+        """
+        Returns an open connection to the given address.
+
+        Args:
+            address:
+                The host, port tuple address of the node
+
+        Return:
+            The RpcConnection, and whether it was already open
+        """
+
+        with self.lock:
+            connection = self.connections.get(address)
+            if connection is not None and not connection.closed:
+                return connection, True
+
+        # Connect without holding up calls to other nodes
+        connection = RpcConnection(address)
+
+        with self.lock:
+            # Use the connection of another thread that got there first
+            current = self.connections.get(address)
+            if current is not None and not current.closed:
+                connection.close()
+                return current, True
+
+            self.connections[address] = connection
+            return connection, False
+
+    def call(self, address, method, arg1=None, arg2=None):
+        """
+        Makes a RPC on the pooled connection to the given address. A call
+        that could not be sent on a connection opened earlier, which may have
+        gone stale while idle, is retried once on a new connection. A call
+        that failed after its request was sent is not, as the node may have
+        carried it out.
+
+        Return:
+            The result and the address hints of the reply
+        """
+
+        connection, reused = self.get(address)
 
-    def __init__(self, n, k, node=None):
-        if not (0 <= n < NODES and 0 < k <= M):
-            raise ValueError('invalid finger entry values')
-        self.start = (n + 2**(k-1)) % NODES
-        self.next_start = (n + 2**k) % NODES if k < M else n
-        self.interval = ModRange(self.start, self.next_start, NODES)
-        self.node = node
+        try:
+            return connection.call(method, arg1, arg2)
+        except NotSent:
+            if not reused:
+                raise
 
-    def __repr__(self):
-        """ Something like the interval|node charts in the paper """
-        return '{}| [{:2}, {:<2} | '.format(self.node, self.start, self.next_start)
+        return self.get(address)[0].call(method, arg1, arg2)
 
-    def __contains__(self, id):
-        """ Is the given id within this finger's interval? """
-        return id in self.interval
+    def close(self):
+        """
+        Closes every connection.
+        """
+
+        with self.lock:
+            connections, self.connections = self.connections, {}
+
+        for connection in connections.values():
+            connection.close()
 
 class ChordNode(object):
     """
@@ -161,7 +927,8 @@ class ChordNode(object):
     presented in the Chord paper.
     """
 
-    def __init__(self, port, buddy_port=None) -> None:
+    def __init__(self, port, buddy_port=None, alpha=ALPHA, workers=WORKERS,
+                 queue_depth=QUEUE_DEPTH, stabilize=STABILIZE, replicas=SUCCESSORS) -> None:
         """
         The ChordNode constructor initilaizes the node's address, thread for 
         running a server, finger table, and stored keys dictionary.
@@ -171,6 +938,22 @@ class ChordNode(object):
                 The port of the server
             buddy_port:
                 The port of a known node on the Chord network
+            alpha:
+                The number of lookup probes kept in flight, 1 for the serial
+                lookup of the paper
+            workers:
+                The number of threads serving RPCs, or 0 to start a thread
+                for every request
+            queue_depth:
+                The number of RPCs that may be queued or running before new
+                ones are rejected as Overloaded
+            stabilize:
+                Whether to join with a single lookup and keep the ring by
+                periodic stabilization, instead of updating every finger
+                table affected by the join
+            replicas:
+                The length r of the successor list, and the number of
+                successors each key is copied to
         """
         
         # Define address of the node
@@ -178,21 +961,44 @@ class ChordNode(object):
 
         # Defined the node as a hash of the address, using Chord class
         self.node = Chord.lookup_node(self.address)
+        Chord.directory.learn(self.node, self.address)
 
         # Initializes finger table for the node
-        self.finger = [None] + [FingerEntry(self.node, k) for k in range(1, M + 1)]
+        self.finger = FingerTable(self.node)
         
         self.predecessor = None # Sets predecessor to None
-        self.keys = {}          # Defines initial dictionary
+        self.keys = KeyStore()  # Defines initial key store
 
         # Gets the node of an existing node, if passed in
         self.buddy_node = Chord.lookup_node((DEFAULT_HOST, buddy_port)) if buddy_port else None
 
+        # Threads probing nodes for parallel lookups
+        self.alpha = alpha
+        self.probes = ThreadPoolExecutor(max_workers=4 * alpha) if alpha > 1 else None
+
+        # Threads serving RPCs, and the count of RPCs queued or running
+        self.workers = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.queue_depth = queue_depth
+        self.queued = 0
+        self.rejected = 0   # RPCs rejected as Overloaded
+        self.queue_lock = threading.Lock()
+
         # Sets up listening server for this node
         self.listener = self.listening_server()
 
         self.joined = False # Set flag to if node is part of a Chord network
 
+        # Periodic stabilization, and the next finger fix_fingers refreshes
+        self.stabilizing = stabilize
+        self.next_finger = 2
+        self.handoff = False    # Keys to pull again before the first predecessor
+
+        # The first r successors, kept by stabilize, which hold the replicas
+        # of the keys this node owns
+        self.replicas = replicas
+        self.successors = []
+        self.rounds = 0
+
         # Display message about node
         print('Node ID = {} on {}'.format(self.node, self.address))
 
@@ -205,7 +1011,7 @@ class ChordNode(object):
         """
 
         # Format of finger table contents
-        finger_table =  ', '.join([str(self.finger[i].node) for i in range(1, M + 1)])
+        finger_table =  ', '.join([str(self.finger.node[i]) for i in range(1, M + 1)])
         
         return '{}: {}[{}]'.format(self.node, self.predecessor, finger_table)
 
@@ -219,19 +1025,38 @@ class ChordNode(object):
             The successor node
         """
 
-        return self.finger[1].node
+        return self.finger.node[1]
 
     @successor.setter
     def successor(self, id):
         """
-        Sets the successor node of the current node.
+        Sets the successor node of the current node, at the head of the
+        successor list.
 
         Args:
             id:
                 The successor node
         """
 
-        self.finger[1].node = id
+        self.finger.node[1] = id
+        if not self.successors or self.successors[0] != id:
+            self.successors = [id] + [s for s in self.successors if s != id][:self.replicas - 1]
+
+    def successor_list(self) -> list:
+        """
+        Returns the successor list, or just the successor if finger 1 has been
+        changed directly since the list was last refreshed, as the eager join
+        and update_finger_table do.
+
+        Return:
+            The list of successor nodes
+        """
+
+        successors = self.successors
+        if not successors or successors[0] != self.successor:
+            return [self.successor]
+
+        return successors
 
     # Finger Tables
     def init_finger_table(self):
@@ -241,7 +1066,7 @@ class ChordNode(object):
         """
 
         # Find the successor and predecessor
-        self.successor = self.call_rpc(self.buddy_node, 'find_successor', self.finger[1].start)
+        self.successor = self.call_rpc(self.buddy_node, 'find_successor', self.finger.start[1])
         self.predecessor = self.call_rpc(self.successor, 'get_predecessor')
         
         # Set predecessor of the current node
@@ -252,10 +1077,10 @@ class ChordNode(object):
         for i in range(1, M):
             # Check if the finger entry is in range, else find successor from 
             # the buddy node
-            if self.finger[i + 1].start in ModRange(self.node, self.finger[i].node, NODES):
-                self.finger[i + 1].node = self.finger[i].node
+            if between(self.node, self.finger.start[i + 1], self.finger.node[i]):
+                self.finger.node[i + 1] = self.finger.node[i]
             else:
-                self.finger[i + 1].node = self.call_rpc(self.buddy_node, 'find_sucessor', self.finger[i + 1].start)
+                self.finger.node[i + 1] = self.call_rpc(self.buddy_node, 'find_successor', self.finger.start[i + 1])
 
     def find_successor(self, id):
         """
@@ -265,9 +1090,22 @@ class ChordNode(object):
             The successor node
         """
 
-        # Find the precessor node for the give id
-        n_prime = self.find_predecessor(id)
-        return self.call_rpc(n_prime, 'successor')
+        return self.find_successors(id)[0]
+
+    def find_successors(self, id) -> list:
+        """
+        Returns the successor node with the given id, followed by the nodes of
+        its predecessor's successor list, which hold the replicas of the id.
+
+        Return:
+            The list of successor nodes
+        """
+
+        # Probe several nodes at once in parallel mode
+        if self.alpha > 1:
+            return self.find_successors_parallel(id)
+
+        return self.lookup(id)[1]
 
     def find_predecessor(self, id) -> int:
         """
@@ -277,14 +1115,148 @@ class ChordNode(object):
             The predecessor of the current node
         """
 
-        # Temporary node to hold
+        return self.lookup(id)[0]
+
+    def lookup(self, id) -> tuple:
+        """
+        Walks the ring to the predecessor of the given id. Each hop is a
+        single lookup_step RPC, returning both the successor list and the
+        closest preceding fingers of the node asked. If the closest finger
+        has failed the next closest is tried, so a lookup gets around failed
+        nodes before stabilization has replaced them.
+
+        Args:
+            id:
+                The id being looked up
+
+        Return:
+            The predecessor of the id and its successor list
+        """
+
+        # Start from the current node
         n_prime = self.node
+        successors, fingers = self.lookup_step(id, FALLBACKS)
+        failed = set()
 
         # Traverse range to find the closest preceding node
-        while id not in ModRange(n_prime + 1, self.call_rpc(n_prime, 'successor') + 1, NODES):
-            n_prime = self.call_rpc(n_prime, 'closest_preceding_finger', id)
-        
-        return n_prime
+        while not between(n_prime + 1, id, successors[0] + 1):
+            for finger in fingers:
+                if finger in failed:
+                    continue
+                try:
+                    successors, next_fingers = self.call_rpc(finger, 'lookup_step', id, FALLBACKS)
+                except (ConnectionError, TimeoutError) as e:
+                    print('Lookup through {} failed: {}'.format(finger, e))
+                    failed.add(finger)
+                    continue
+                n_prime, fingers = finger, next_fingers
+                break
+            else:
+                raise LookupError('No live finger of {} precedes {}'.format(n_prime, id))
+
+        return n_prime, successors
+
+    def lookup_step(self, id, count=None) -> tuple:
+        """
+        Answers one hop of a lookup with the current node's successor list and
+        its closest preceding fingers of the given id.
+
+        Args:
+            id:
+                The id being looked up
+            count:
+                The number of preceding fingers wanted, or None for just the
+                closest one
+
+        Return:
+            The successor list, and the closest preceding finger or the list
+            of them
+        """
+
+        successors = self.successor_list()
+
+        if count is None:
+            return successors, self.finger.closest_preceding(id)
+
+        return successors, self.finger.preceding(id, count)
+
+    def find_successors_parallel(self, id) -> list:
+        """
+        Returns the successor list of the given id, keeping up to alpha
+        lookup_step probes in flight like a Kademlia lookup. Each reply adds
+        the fingers of the node probed to the candidates, and the candidates
+        closest to id are probed first, so a slow or failed node only holds
+        up the lookup if no other path gets there before it. A probe without
+        a reply after PROBE_TIMEOUT gives up its slot to the next closest
+        candidate, though its reply is still used if it arrives. Once a probe
+        has stalled, a successor list spanning id also ends the lookup, with
+        the part of the list from the successor of id on, as a slow
+        predecessor of id would otherwise hold it up.
+
+        Args:
+            id:
+                The id being looked up
+
+        Return:
+            The list of successor nodes
+        """
+
+        # Candidate nodes, the probes in flight by future, and the slow ones
+        candidates = {self.node}
+        probed = set()
+        in_flight = {}
+        stalled = set()
+        spanned = None  # The tail of a successor list past id, if any
+        deadline = time.monotonic() + RPC_TIMEOUT
+
+        while True:
+            # Probe the unprobed candidates that most closely precede id
+            waiting = sorted(candidates - probed, key=lambda n: (id - n) % NODES)
+            for n in waiting[:self.alpha - len(in_flight) + len(stalled)]:
+                probed.add(n)
+                in_flight[self.probes.submit(self.call_rpc, n, 'lookup_step', id, self.alpha)] = n
+
+            if not in_flight:
+                raise LookupError('No node answered a lookup of {}'.format(id))
+
+            # Wait briefly, so a slow probe can be worked around
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('lookup of {} timed out'.format(id))
+
+            done, _ = wait(in_flight, timeout=min(remaining, PROBE_TIMEOUT),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # Let the next closest candidates go ahead of the slow probes
+                stalled.update(in_flight)
+                if spanned is not None:
+                    return spanned
+                continue
+
+            for future in done:
+                n = in_flight.pop(future)
+                stalled.discard(future)
+
+                try:
+                    successors, fingers = future.result()
+                except Exception as e:
+                    print('Probe of {} failed: {}'.format(n, e))
+                    continue
+
+                # The node probed is the predecessor of id
+                if between(n + 1, id, successors[0] + 1):
+                    return successors
+
+                # Keep a successor list holding the answer further along
+                for i in range(1, len(successors)):
+                    if spanned is None and \
+                            between(successors[i - 1] + 1, id, successors[i] + 1):
+                        spanned = successors[i:]
+
+                candidates.update(fingers)
+
+            if stalled and spanned is not None:
+                return spanned
 
     def closest_preceding_finger(self, id) -> int:
         """
@@ -295,13 +1267,8 @@ class ChordNode(object):
             The closest preceding node
         """
 
-        # Traverse though range of nodes, starting at the bottom
-        for i in range(M, 0, -1):
-            # Return finger if it is found in the node's table
-            if self.finger[i].node in ModRange(self.node + 1, id, NODES):
-                return self.finger[i].node
-        
-        return self.node
+        # Scan the finger table from the farthest finger back
+        return self.finger.closest_preceding(id)
 
     def update_others(self):
         """
@@ -322,11 +1289,11 @@ class ChordNode(object):
 
         """
 
-        if (self.finger[i].start != self.finger[i].node 
-                and s in ModRange(self.finger[i].start, self.finger[i].node, NODES)):
+        start, node = self.finger.start[i], self.finger.node[i]
+        if start != node and between(start, s, node):
             print('update_finger_table({},{}): {}[{}] = {} since {} in [{},{})'.format(
-                    s, i, self.node, i, s, s, self.finger[i].start, self.finger[i].node))
-            self.finger[i].node = s
+                    s, i, self.node, i, s, s, start, node))
+            self.finger.node[i] = s
             print('#', self)
             p = self.predecessor  # Get first node preceding myself
             self.call_rpc(p, 'update_finger_table', s, i)
@@ -334,7 +1301,290 @@ class ChordNode(object):
         else:
             return 'did nothing {}'.format(self)
 
+    # Stabilization
+    def maintain(self):
+        """
+        Runs stabilize, fix_fingers and check_predecessor every
+        STABILIZE_INTERVAL seconds, for as long as the node runs. Failed rounds
+        are reported and retried on the next interval.
+        """
+
+        while True:
+            time.sleep(STABILIZE_INTERVAL)
+
+            tasks = [self.stabilize, self.fix_fingers, self.check_predecessor]
+
+            # Repair replicas every few rounds
+            self.rounds += 1
+            if self.rounds % REPAIR_ROUNDS == 0:
+                tasks.append(self.repair_replicas)
+
+            for task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    print('{} failed: {}'.format(task.__name__, e))
+
+    def stabilize(self):
+        """
+        Verifies the current node's successor, adopting a node that joined
+        between them, and tells the successor about the current node. A
+        successor that has stopped answering is replaced by the next one in
+        the successor list, which is then refreshed from the new successor.
+        """
+
+        while True:
+            try:
+                x = self.call_rpc(self.successor, 'get_predecessor')
+                break
+            except (ConnectionError, TimeoutError) as e:
+                print('Successor {} failed: {}'.format(self.successor, e))
+                self.drop_successor()
+
+        # A node in (n, successor) has joined since the last round
+        if x is not None and between(self.node + 1, x, self.successor):
+            self.successor = x
+
+        self.call_rpc(self.successor, 'notify', self.node)
+
+        # Copy the successor's list, up to this node or r entries
+        successors = [self.successor]
+        for s in self.call_rpc(self.successor, 'get_successors'):
+            if s == self.node or s in successors or len(successors) == self.replicas:
+                break
+            successors.append(s)
+        self.successors = successors
+
+    def drop_successor(self):
+        """
+        Replaces a failed successor with the next node of the successor list,
+        or with the current node itself once the list is exhausted.
+        """
+
+        self.successors = self.successors[1:]
+        self.successor = self.successors[0] if self.successors else self.node
+
+    def notify(self, n_prime):
+        """
+        Adopts n_prime as the predecessor if it is closer than the current one.
+
+        A node that has just joined first pulls its part of the ring from the
+        successor again, as the successor kept accepting writes to it from
+        the copy at join until this node notified it. By the time a
+        predecessor notifies this node, the successor has stopped owning the
+        part, so no write is left behind.
+
+        Args:
+            n_prime:
+                The node that thinks it might be the predecessor
+        """
+
+        if self.predecessor is None or between(self.predecessor + 1, n_prime, self.node):
+            # Take the keys written since join before owning them
+            if self.handoff:
+                self.migrate_keys(n_prime + 1, self.node + 1)
+                self.handoff = False
+
+            self.predecessor = n_prime
+
+    def fix_fingers(self):
+        """
+        Refreshes the next finger with a lookup. The following fingers whose
+        starts fall before the node found share it, so they are set without
+        lookups of their own, and a round covers one distinct finger node.
+        Finger 1 is the successor, kept by stabilize.
+        """
+
+        k = self.next_finger
+        self.finger.node[k] = node = self.find_successor(self.finger.start[k])
+
+        # Copy forward while the next start is in (n, node]
+        while k < M and between(self.node + 1, self.finger.start[k + 1], node + 1):
+            k += 1
+            self.finger.node[k] = node
+
+        self.next_finger = k + 1 if k < M else 2
+
+    def check_predecessor(self):
+        """
+        Clears the predecessor if it has stopped answering, so that notify
+        can replace it.
+        """
+
+        if self.predecessor is None or self.predecessor == self.node:
+            return
+
+        try:
+            self.call_rpc(self.predecessor, 'ping')
+        except (ConnectionError, TimeoutError) as e:
+            print('Predecessor {} failed: {}'.format(self.predecessor, e))
+            self.predecessor = None
+
+    # Replication
+    def replicate(self, values):
+        """
+        Copies values this node owns to every successor in its list. Failed
+        copies are left to repair_replicas.
+
+        Args:
+            values:
+                The dictionary of values by id
+        """
+
+        for s in self.successor_list():
+            if s == self.node:
+                continue
+            try:
+                self.call_rpc(s, 'put_replicas', values)
+            except (ConnectionError, TimeoutError, Overloaded) as e:
+                print('Replication to {} failed: {}'.format(s, e))
+
+    def put_replicas(self, values):
+        """
+        Stores values copied from the node that owns them.
+
+        Args:
+            values:
+                The dictionary of values by id
+        """
+
+        self.keys.update(values)
+
+    def stale_replicas(self, digests) -> list:
+        """
+        Returns the ids that this node holds no value for, or a value that
+        differs from the owner's.
+
+        Args:
+            digests:
+                The dictionary of the digests of the owner's values by id
+        """
+
+        return [id for id, d in digests.items()
+                if id not in self.keys or digest(self.keys[id]) != d]
+
+    def repair_replicas(self):
+        """
+        Copies the owned values each successor is missing or holds an older
+        value of, as found by asking it with the digests of the owned values.
+        A successor that fails is left to the next repair.
+        """
+
+        if self.predecessor is None:
+            return
+
+        owned = self.keys.range(self.predecessor + 1, self.node + 1)
+        if not owned:
+            return
+
+        digests = {id: digest(self.keys[id]) for id in owned}
+
+        for s in self.successor_list():
+            if s == self.node:
+                continue
+            try:
+                stale = self.call_rpc(s, 'stale_replicas', digests)
+                if stale:
+                    print('Repairing {} replicas on {}'.format(len(stale), s))
+                    self.call_rpc(s, 'put_replicas', {id: self.keys[id] for id in stale})
+            except (ConnectionError, TimeoutError, Overloaded) as e:
+                print('Repair of {} failed: {}'.format(s, e))
+
+    def read_value(self, id):
+        """
+        Returns the value of an id held by this node, without routing, as the
+        owner or as one of its replicas.
+
+        Args:
+            id:
+                The id of a key
+
+        Return:
+            The value, or None if it is not held here
+        """
+
+        return self.keys.get(id)
+
+    # Migration
+    def transfer_keys(self, start, stop) -> list:
+        """
+        Returns the first batch of held keys in [start, stop), in id order.
+
+        Args:
+            start:
+                The first id of the interval
+            stop:
+                The id after the interval
+
+        Return:
+            The list of up to MIGRATE_BATCH id, value pairs
+        """
+
+        return self.keys.items(start, stop, MIGRATE_BATCH)
+
+    def migrate_keys(self, start, stop):
+        """
+        Copies the keys in [start, stop) held by the successor to this node,
+        one batch per RPC. The successor keeps its copies, as it is a replica
+        of this node.
+
+        Args:
+            start:
+                The first id of the interval
+            stop:
+                The id after the interval
+        """
+
+        moved = 0
+
+        while True:
+            batch = self.call_rpc(self.successor, 'transfer_keys', start, stop)
+            self.keys.update(dict(batch))
+            moved += len(batch)
+
+            # Continue after the last id, until the interval is done
+            if len(batch) < MIGRATE_BATCH or (batch[-1][0] + 1) % NODES == stop % NODES:
+                break
+            start = batch[-1][0] + 1
+
+        print('Migrated {} keys from {}'.format(moved, self.successor))
+
+    def leave(self):
+        """
+        Leaves the network gracefully, handing the owned keys to the successor
+        in batches and telling it about the new predecessor. The predecessor
+        finds the new successor when its next stabilize reaches this node.
+        """
+
+        if self.successor is None or self.successor == self.node:
+            return
+
+        # Keys in (predecessor, n], or every key if the predecessor is unknown
+        start = self.predecessor + 1 if self.predecessor is not None else self.node + 1
+        owned = self.keys.range(start, self.node + 1)
+
+        for first in range(0, len(owned), MIGRATE_BATCH):
+            batch = owned[first:first + MIGRATE_BATCH]
+            self.call_rpc(self.successor, 'put_replicas', {id: self.keys[id] for id in batch})
+
+        self.call_rpc(self.successor, 'set_predecessor', self.predecessor)
+        print('{} left the network, handing {} keys to {}'.format(
+            self.node, len(owned), self.successor))
+
     # Data
+    def owns(self, id) -> bool:
+        """
+        Returns whether the id is in (predecessor, n], the current node's part
+        of the ring. Nothing is known to be owned while the predecessor is
+        unknown.
+
+        Args:
+            id:
+                The id of a key
+        """
+
+        return self.predecessor is not None and between(self.predecessor + 1, id, self.node + 1)
+
     def put_value(self, key, data):
         """
         Puts a value associated with the given key into the system.
@@ -350,17 +1600,19 @@ class ChordNode(object):
         """
 
         # Get the id based on the hashed value of the key
-        id = Chord.hash(key, M)
+        id = Chord.hash(key) % NODES
 
-        # Check if the id already exists, and store data
-        if id in ModRange(self.predecessor + 1, self.node + 1, NODES):
+        # Check if the id belongs to this node, otherwise find its successor
+        n_prime = self.node if self.owns(id) else self.find_successor(id)
+
+        # Store data here and on the replicas, or at the successor
+        if n_prime == self.node:
             self.keys[id] = data
             print('Putting {}, {} at: {}'.format(key, data, id))
+            self.replicate({id: data})
             return
         else:
-            # Key has not been found, need to find the successor recursively
-            n_prime = self.find_successor(id)
-            return self.call_rpc(n_prime, 'put_value', id, data)
+            return self.call_rpc(n_prime, 'put_value', key, data)
 
     def get_value(self, key):
         """
@@ -375,16 +1627,26 @@ class ChordNode(object):
         """
 
         # Get the id based on the hashed value of the key
-        id = Chord.hash(key, M)
+        id = Chord.hash(key) % NODES
 
-        # Check if the id already exists, and return data
-        if id in ModRange(self.predecessor + 1, self.node + 1, NODES):
+        # Return data from here if the id belongs to this node
+        if self.owns(id):
             print('Data found at: {}'.format(id))
             return self.keys[id] if id in self.keys else None
-        else:
-            # Key has not been found, need to find the successor recursively
-            n_prime = self.find_successor(id)
-            return self.call_rpc(n_prime, 'get_value', id)
+
+        # Otherwise read from a random replica, falling back to the successor
+        # if the replica has not been repaired yet or has failed
+        successors = self.find_successors(id)
+        n_prime = random.choice(successors)
+
+        try:
+            data = self.call_rpc(n_prime, 'read_value', id)
+            if data is not None or n_prime == successors[0]:
+                return data
+        except (ConnectionError, TimeoutError, Overloaded) as e:
+            print('Read from replica {} failed: {}'.format(n_prime, e))
+
+        return self.call_rpc(successors[0], 'read_value', id)
 
     # RPCs
     def call_rpc(self, n_prime, method, arg1=None, arg2=None):
@@ -452,11 +1714,39 @@ class ChordNode(object):
         elif method == 'find_successor':    # find_successor call
             result = self.find_successor(arg1)
 
-        elif method == 'predecessor':       # predecessor call
-            if arg1 is not None:
-                self.successor = arg1
-            
-            result = self.successor
+        elif method == 'lookup_step':       # lookup_step call
+            result = self.lookup_step(arg1, arg2)
+
+        elif method == 'get_predecessor':   # get_predecessor call
+            result = self.predecessor
+
+        elif method == 'set_predecessor':   # set_predecessor call
+            self.predecessor = arg1
+            result = None
+
+        elif method == 'notify':            # notify call
+            result = self.notify(arg1)
+
+        elif method == 'ping':              # ping call
+            result = True
+
+        elif method == 'get_successors':    # get_successors call
+            result = self.successor_list()
+
+        elif method == 'put_replicas':      # put_replicas call
+            result = self.put_replicas(arg1)
+
+        elif method == 'stale_replicas':  # stale_replicas call
+            result = self.stale_replicas(arg1)
+
+        elif method == 'read_value':        # read_value call
+            result = self.read_value(arg1)
+
+        elif method == 'transfer_keys':     # transfer_keys call
+            result = self.transfer_keys(arg1, arg2)
+
+        elif method == 'count_keys':        # count_keys call
+            result = self.keys.count(arg1, arg2)
 
         # closest_preceding_finger call
         elif method == 'closest_preceding_finger':
@@ -478,9 +1768,11 @@ class ChordNode(object):
 
     def handle_rpc(self, client):
         """
-        Handles RPC from other nodes.
+        Handles RPCs from another node or client.
 
-        The handle_rpc function processes remote calls from the listening server
+        The handle_rpc function reads requests from one connection until it
+        closes and hands each one to submit_rpc. Replies carry the request id,
+        so they can go back in any order.
 
         Args:
             client:
@@ -488,16 +1780,148 @@ class ChordNode(object):
 
         """
 
-        # Receive message and parse
-        rpc = client.recv(BUFFER_SIZE)
-        method, arg1, arg2 = pickle.loads(rpc)
+        # Serialize the replies of the request threads
+        send_lock = threading.Lock()
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        # Display request
-        print('RPC request {} from {}'.format(method, client))
-        
-        # Get result and send back to other node
-        result = self.dispatch_rpc(method, arg1, arg2)
-        client.sendall(pickle.dumps(result))
+        # Display connection
+        print('RPC connection from {}'.format(client.getpeername()))
+
+        try:
+            while True:
+                # Receive request and parse
+                request = recv_frame(client)
+                if request is None:
+                    break
+
+                self.submit_rpc(client, send_lock, request)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print('RPC connection failed: {}'.format(e))
+        finally:
+            # Close even on an unexpected error, failing the caller's calls
+            client.close()
+
+    def submit_rpc(self, client, send_lock, request):
+        """
+        Queues a request for the workers, or rejects it as Overloaded when
+        the queue is full. Requests are served off the connection's thread.
+
+        The workers only serve requests answered from this node's state. The
+        NESTED_RPCS, which wait on RPCs to other nodes, get a thread of their
+        own, so a chain of nested calls can never hold every worker while
+        the calls it waits on sit in the queue. They still count against the
+        queue depth, and are rejected with the rest once it is full.
+
+        Args:
+            client:
+                The TCP socket the request came in on
+            send_lock:
+                The lock serializing replies on the socket
+            request:
+                The request id, method and arguments
+        """
+
+        # Without workers, start a thread for every request
+        if self.workers is None:
+            threading.Thread(target=self.reply_rpc, args=(client, send_lock, request)).start()
+            return
+
+        with self.queue_lock:
+            accepted = self.queued < self.queue_depth
+            if accepted:
+                self.queued += 1
+            else:
+                self.rejected += 1
+
+        if not accepted:
+            error = Overloaded('node {} has {} RPCs queued'.format(self.node, self.queue_depth))
+            self.send_reply(client, send_lock, request[0], None, error)
+            return
+
+        if request[1] in NESTED_RPCS:
+            threading.Thread(target=self.reply_nested, args=(client, send_lock, request)).start()
+            return
+
+        self.workers.submit(self.reply_rpc, client, send_lock, request).add_done_callback(
+            self.release_rpc)
+
+    def release_rpc(self, future=None):
+        """
+        Frees the queue slot of a request once it has been served.
+        """
+
+        with self.queue_lock:
+            self.queued -= 1
+
+    def reply_nested(self, client, send_lock, request):
+        """
+        Serves a request that makes RPCs of its own on its own thread, then
+        frees its queue slot.
+
+        Args:
+            client:
+                The TCP socket the request came in on
+            send_lock:
+                The lock serializing replies on the socket
+            request:
+                The request id, method and arguments
+        """
+
+        try:
+            self.reply_rpc(client, send_lock, request)
+        finally:
+            self.release_rpc()
+
+    def reply_rpc(self, client, send_lock, request):
+        """
+        Dispatches one request and sends back its reply.
+
+        Args:
+            client:
+                The TCP socket the request came in on
+            send_lock:
+                The lock serializing replies on the socket
+            request:
+                The request id, method and arguments
+        """
+
+        request_id, method, arg1, arg2 = request
+        result, error = None, None
+
+        # Get result, or the error to raise at the caller
+        try:
+            result = self.dispatch_rpc(method, arg1, arg2)
+        except Exception as e:
+            error = e
+
+        self.send_reply(client, send_lock, request_id, result, error)
+
+    def send_reply(self, client, send_lock, request_id, result, error=None):
+        """
+        Sends the reply of a request back to the other node, with the
+        addresses of this node and any node in the result.
+
+        Args:
+            client:
+                The TCP socket the request came in on
+            send_lock:
+                The lock serializing replies on the socket
+            request_id:
+                The id of the request
+            result:
+                The value of the RPC method
+            error:
+                The exception to raise at the caller, if the method failed
+        """
+
+        hints = Chord.directory.hints(self.node, result)
+        failure = encode_error(error) if error is not None else None
+
+        try:
+            with send_lock:
+                send_frame(client, (request_id, result, hints, failure))
+        except OSError:
+            pass    # Connection closed, the caller has already failed
 
     # Servers
     def listening_server(self) -> socket:
@@ -510,6 +1934,7 @@ class ChordNode(object):
 
         # Use socket to create a TCP/IP server
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind(self.address)
         server.listen(BACKLOG)
 
@@ -538,15 +1963,35 @@ class ChordNode(object):
         Joins the current node to the Chord network.
         """
 
+        # Find the successor with one lookup from the buddy node, pointing
+        # every finger at it until fix_fingers refreshes them
+        if self.stabilizing:
+            successor = self.node
+            if self.buddy_node is not None:
+                successor = self.call_rpc(self.buddy_node, 'find_successor', self.node)
+            
+            for i in range(1, M + 1):
+                self.finger.node[i] = successor
+            self.predecessor = None if self.buddy_node is not None else self.node
+
+            # Take the keys outside (n, successor], the successor's part, and
+            # the ones written to it until it learns of this node
+            if self.buddy_node is not None:
+                self.migrate_keys(successor + 1, self.node + 1)
+                self.handoff = True
+
+            threading.Thread(target=self.maintain, daemon=True).start()
+
         # Get help from the buddy node to initialize
-        if self.buddy_node is not None:
+        elif self.buddy_node is not None:
             self.init_finger_table()
+            self.migrate_keys(self.successor + 1, self.node + 1)
             self.update_others()
         
         # Otherwise need to initalize own finger table and predecessor
         else:
             for i in range(1, M + 1):
-                self.finger[i].node = self.node
+                self.finger.node[i] = self.node
             self.predecessor = self.node
         
         # Set joined flag and display message
@@ -559,7 +2004,8 @@ class Chord(object):
     system.
     """
 
-    node_map = {}   # Dictionary to store nodes
+    directory = None    # NodeDirectory of node addresses, created below
+    connections = None  # ConnectionPool to the nodes, created below
 
     @staticmethod
     def call_rpc(node, method, arg1=None, arg2=None):
@@ -569,27 +2015,19 @@ class Chord(object):
 
         # Get the address of the given node
         address = Chord.lookup_address(node)
+        if address is None:
+            raise LookupError('No address known for node {}'.format(node))
         print(address)
         # Format request for display
         request = 'Node: {}; Method: {}; ({},{})'.format(node, method,
                                                         str(arg1), str(arg2))
         print(request)
 
-        # Create socket using TCP
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            #try:
-                # Connect to address, and get message
-            sock.connect(address)
-            message = pickle.dumps((method, arg1, arg2))
-                
-            # Send message back and get result
-            sock.sendall(message)
-            result = pickle.loads(sock.recv(BUFFER_SIZE))
-            print('\tResult: ', result)
-            return result
-            
-            #except Exception as e:
-               #print('Connection to node at {} failed. Connection timeout at {}'.format(address, datetime.now().time()))
+        # Call over the pooled connection to the node
+        result, hints = Chord.connections.call(address, method, arg1, arg2)
+        Chord.directory.learn_all(hints)
+        print('\tResult: ', result)
+        return result
 
     @staticmethod
     def put_value(node, key, value):
@@ -616,36 +2054,17 @@ class Chord(object):
     @staticmethod
     def lookup_address(node) -> tuple:
         """
-        Returns the address of a given node.
+        Returns the address of a given node from the directory.
         
         Args:
             node:
                 The node in the system
 
         Return:
-            The host, port tuple address of the node 
+            The host, port tuple address of the node, or None if unknown
         """
 
-        # Looks at current node map
-        if node not in Chord.node_map:
-            # Traverse port range to find available port
-            for port in range(PORT_START, PORT_END):
-                address = (DEFAULT_HOST, port)
-
-                # Create temporary node
-                temp_node = Chord.lookup_node(address)
-
-                # If the temp node and node are equal, bind address
-                if temp_node == node:
-                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                        try:
-                            sock.bind(address)
-                        except Exception as e:
-                            Chord.node_map[node] = address
-                            return address
-            return None
-
-        return Chord.node_map[node]
+        return Chord.directory.lookup(node)
 
     @staticmethod
     def lookup_node(address):
@@ -672,14 +2091,19 @@ class Chord(object):
         hashed_data = hashlib.sha1(temp_data).digest()
         return int.from_bytes(hashed_data, byteorder='big')
 
+# Directory shared by every node and client in this process
+Chord.directory = NodeDirectory()
+Chord.connections = ConnectionPool()
+
 
 # Main Function
 if __name__ == '__main__':
     # Check length of command line arguements
-    if len(sys.argv) not in (2,3):
-        print('Usage: python3 chord_node.py PORT [BUDDY]')
+    if len(sys.argv) not in (2,3,4):
+        print('Usage: python3 chord_node.py PORT [BUDDY] [ALPHA]')
         print('PORT = 0, if starting new network')
         print('[BUDDY] is the port number of an existing node')
+        print('[ALPHA] is the number of parallel lookup probes, default {}'.format(ALPHA))
         exit(1)
     
     # Set port based on input from the command line arguments
@@ -687,10 +2111,24 @@ if __name__ == '__main__':
 
     # If a buddy node is given, set port based on the input, otherwise None
     buddy = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    alpha = int(sys.argv[3]) if len(sys.argv) > 3 else ALPHA
 
     # Create ChordNode object
-    lab4 = ChordNode(port, buddy)
+    lab4 = ChordNode(port, buddy, alpha)
+
+    # Leave gracefully when terminated as well as when interrupted
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
     # Join network and run server
     lab4.join()
-    lab4.run_server()
\ No newline at end of file
+    try:
+        lab4.run_server()
+    except KeyboardInterrupt:
+        try:
+            lab4.leave()
+        except Exception as e:
+            print('Leaving failed: {}'.format(e))
+        finally:
+            # Exit without waiting on the server and connection threads
+            sys.stdout.flush()
+            os._exit(0)
\ No newline at end of file
@@ -45,7 +45,7 @@ def populate_from_csv(port, filename):
     """
 
     # Get the node for the give port
-    node = Chord.lookup_address(port)
+    node = Chord.lookup_node((DEFAULT_HOST, port))
     count = 0       # Count the number of rows
 
     # Open a csv file
@@ -55,18 +55,16 @@ class chord_query(object):
         
         # If a value is returned
         if result:
-            # Set id and year based on values retured
-            id = result[0][1]
-            year = result[2][1] if result[2][0] == 'Year' else result[3][1]
-            found_key = id + year
+            # Set key based on the id and year of the row returned
+            found_key = (result['Player Id'], result['Year'])
 
             # If key retuned is the same as the key being searched
             if found_key == self.key:
                 # Traverse dictionary and display
-                for key, value in result:
+                for key, value in result.items():
                     print('{}: {}'.format(key,value))
             else:
-                print('Collision: {} and {} do not match').format(self.key, found_key)
+                print('Collision: {} and {} do not match'.format(self.key, found_key))
         
         else:
             print('Nothing found for {}'.format(self.key))